@@ -0,0 +1,424 @@
+# benchmark.py
+# Бенчмарки бота, не требующие доступа к Telegram.
+# transport - пропускная способность запросов к Bot API при разных размерах пула соединений
+# на локальном фейковом сервере Bot API: python benchmark.py transport --pool-sizes 1 2 4 8 16
+# timewarp - прокрутка запусков публикации за несколько недель на синтетической базе с фейковым ботом
+# и подмененными часами: python benchmark.py timewarp --days 30 --chats 20
+# (любой движок хранилища: --backend memory или --backend postgres --dsn 'dbname=reposts_sim')
+# memory - пиковая память команды /list и пачек публикации для чата с 10 тыс. - 1 млн репостов:
+# python benchmark.py memory --sizes 10000 100000 1000000
+
+import argparse
+import json
+import logging
+import os
+import random
+import tempfile
+import threading
+import time
+import tracemalloc
+from datetime import datetime, timedelta
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from types import SimpleNamespace
+
+import pytz
+from telegram.error import BadRequest, TimedOut
+
+import main
+from storage import SQLiteStorage, create_storage
+
+BENCHMARK_TOKEN = '123456:BENCHMARK'
+
+
+# Фейковый сервер Bot API: отвечает на любой метод успешным ответом с задержкой latency секунд
+# и считает открытые клиентами TCP-соединения
+class FakeBotAPIHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'  # keep-alive
+    disable_nagle_algorithm = True  # заголовки и тело ответа пишутся отдельно
+
+    def setup(self):
+        super().setup()
+        with self.server.lock:
+            self.server.connections += 1
+
+    def do_POST(self):
+        self.rfile.read(int(self.headers.get('Content-Length', 0)))
+        time.sleep(self.server.latency)
+        with self.server.lock:
+            self.server.requests += 1
+            message_id = self.server.requests
+
+        method = self.path.rsplit('/', 1)[-1]
+        if method == 'getMe':
+            result = {'id': 123456, 'is_bot': True, 'first_name': 'Benchmark', 'username': 'benchmark_bot'}
+        elif method in ('copyMessage', 'forwardMessage', 'sendMessage'):
+            result = {'message_id': message_id}
+        else:
+            result = True
+        body = json.dumps({'ok': True, 'result': result}).encode()
+
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class FakeBotAPIServer(ThreadingHTTPServer):
+    daemon_threads = True
+    request_queue_size = 256  # одновременные подключения всех потоков бенчмарка
+
+
+# Запуск фейкового сервера Bot API в фоновом потоке
+def start_fake_bot_api(latency):
+    server = FakeBotAPIServer(('127.0.0.1', 0), FakeBotAPIHandler)
+    server.lock = threading.Lock()
+    server.latency = latency
+    server.requests = 0
+    server.connections = 0
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+# Отправка requests вызовов copy_message из threads потоков через бота с пулом pool_size.
+# Возвращает (запросов в секунду, средняя задержка запроса в мс, открыто соединений)
+def run_transport(server, pool_size, threads, requests):
+    bot = main.create_bot(pool_size, token=BENCHMARK_TOKEN, base_url=f'http://127.0.0.1:{server.server_port}/bot')
+    remaining = iter(range(requests))
+    remaining_lock = threading.Lock()
+    durations = []
+
+    def worker():
+        while True:
+            with remaining_lock:
+                if next(remaining, None) is None:
+                    return
+            started = time.perf_counter()
+            bot.copy_message(chat_id=-100, from_chat_id=-200, message_id=1)
+            durations.append(time.perf_counter() - started)
+
+    connections_before = server.connections
+    started = time.perf_counter()
+    workers = [threading.Thread(target=worker) for _ in range(threads)]
+    for thread in workers:
+        thread.start()
+    for thread in workers:
+        thread.join()
+    elapsed = time.perf_counter() - started
+    return requests / elapsed, sum(durations) / len(durations) * 1000, server.connections - connections_before
+
+
+def benchmark_transport(args):
+    # Переполненный пул urllib3 пишет предупреждение на каждое лишнее соединение
+    logging.getLogger('telegram.vendor.ptb_urllib3.urllib3.connectionpool').setLevel(logging.ERROR)
+
+    server = start_fake_bot_api(args.latency / 1000)
+    print(f"Фейковый Bot API: задержка {args.latency} мс, потоков {args.threads}, запросов {args.requests}")
+    print(f"{'пул':>5} | {'запросов/с':>10} | {'мс/запрос':>9} | соединений")
+    for pool_size in args.pool_sizes:
+        throughput, latency, connections = run_transport(server, pool_size, args.threads, args.requests)
+        print(f"{pool_size:>5} | {throughput:>10.0f} | {latency:>9.1f} | {connections}")
+    server.shutdown()
+
+
+# Часы симуляции: время меняется только вызовом advance, паузы между повторами не ждут
+class SimulatedClock:
+    def __init__(self, start):
+        self.current = start
+
+    def now(self):
+        return self.current
+
+    def sleep(self, seconds):
+        pass
+
+    def advance(self, delta):
+        self.current += delta
+
+
+# Фейковый бот для симуляции: отвечает без обращения к сети с задержкой latency секунд,
+# доля failure_rate отправок завершается временной ошибкой, сообщения из deleted считаются удаленными в источнике
+class SimulatedBot:
+    def __init__(self, latency, failure_rate, seed):
+        self.latency = latency
+        self.failure_rate = failure_rate
+        self.random = random.Random(seed)
+        self.lock = threading.Lock()
+        self.deleted = set()
+        self.missing = 0
+        self.sent = 0
+        self.failed = 0
+        self.notifications = 0
+
+    def get_chat(self, chat_id):
+        return SimpleNamespace(id=chat_id, title=f'Channel {chat_id}', username=None)
+
+    def copy_message(self, chat_id, from_chat_id, message_id):
+        if self.latency:
+            time.sleep(self.latency)
+        with self.lock:
+            if (from_chat_id, message_id) in self.deleted:
+                self.missing += 1
+                raise BadRequest("Message to copy not found")
+            if self.random.random() < self.failure_rate:
+                self.failed += 1
+                raise TimedOut()
+            self.sent += 1
+            return SimpleNamespace(message_id=self.sent)
+
+    def send_message(self, chat_id, text):
+        with self.lock:
+            self.notifications += 1
+            return SimpleNamespace(message_id=0)
+
+
+# Синтетические чаты со смешанными настройками: 1-4 времени публикации (чаще в круглые часы),
+# 1-days дней, режим отправки, окно разнесения и целевой канал
+def create_synthetic_chats(chats, days, rng):
+    schedules = {}
+    for chat_id in range(1, chats + 1):
+        times = sorted({f"{rng.randrange(24):02d}:{rng.choice((0, 0, 0, 15, 30, 45, rng.randrange(60))):02d}"
+                        for _ in range(rng.randint(1, 4))})
+        days_offset = rng.randint(1, days)
+        main.storage.update_settings(chat_id, time1=', '.join(times), days_offset=days_offset,
+                                     send_mode=rng.choice(('forward', 'copy')), spread_minutes=rng.choice((0, 0, 5, 15)))
+        main.storage.set_target(chat_id, -1000000000 - chat_id, None)
+        schedules[chat_id] = (times, days_offset)
+    return schedules
+
+
+# Размер базы в байтах: файлы SQLite (с журналом WAL) или pg_database_size для PostgreSQL, None - хранилище в памяти
+def database_size(storage, path=None):
+    if storage.name == 'sqlite':
+        return sum(os.path.getsize(name) for name in (path, f'{path}-wal') if os.path.exists(name))
+    if storage.name == 'postgres':
+        with storage.connect() as conn:
+            cursor = conn.cursor()
+            cursor.execute('SELECT pg_database_size(current_database())')
+            return cursor.fetchone()[0]
+    return None
+
+
+# Размер базы в КБ для отчета
+def format_size(size):
+    return f"{size / 1024:.0f}" if size is not None else "-"
+
+
+# Хранилище симуляции: новая база SQLite (args.db или временный файл), память или пустая база PostgreSQL args.dsn.
+# Возвращает (хранилище, путь к файлу SQLite или None, временный каталог или None)
+def create_simulation_storage(args):
+    if args.backend == 'postgres':
+        if not args.dsn:
+            raise SystemExit("Для --backend postgres нужна строка подключения --dsn.")
+        storage = create_storage('postgres', postgres_dsn=args.dsn, postgres_pool_size=4)
+        storage.init()
+        if storage.get_active_chats():
+            raise SystemExit("База PostgreSQL не пуста, симуляции нужна новая база.")
+        return storage, None, None
+    if args.backend == 'memory':
+        return create_storage('memory'), None, None
+
+    workdir = None
+    if args.db:
+        if os.path.exists(args.db):
+            raise SystemExit(f"Файл {args.db} уже существует, симуляции нужна новая база.")
+        path = args.db
+    else:
+        workdir = tempfile.TemporaryDirectory()
+        path = os.path.join(workdir.name, 'reposts.db')
+    return SQLiteStorage(path), path, workdir
+
+
+# Число чатов, у которых счетчики сводки (pending_count, published_count) расходятся с обходом их репостов
+def count_summary_mismatches(chat_ids):
+    mismatches = 0
+    for chat_id in chat_ids:
+        summary = main.storage.get_chat_summary(chat_id)
+        published = [row[5] for row in main.storage.iter_reposts(chat_id)]
+        if (summary['pending_count'], summary['published_count']) != (published.count(0), published.count(1)):
+            mismatches += 1
+    return mismatches
+
+
+# Прокрутка запусков публикации (тиков) за args.days дней. Каждые сутки в полночь каждый чат пересылает
+# args.posts сообщений, тики выполняются в начале каждой минуты по часам симуляции. Тик дольше минуты
+# сдвигает следующий на время своего выполнения, как в цикле публикации, и следующий догоняет отставание
+def benchmark_timewarp(args):
+    logging.getLogger('main').setLevel(logging.ERROR)
+    logging.getLogger('storage').setLevel(logging.ERROR)
+
+    main.current_timezone = pytz.timezone(args.timezone)
+    start = main.current_timezone.localize(datetime.strptime(args.start, '%Y-%m-%d'))
+    clock = SimulatedClock(start)
+    main.set_clock(clock)
+
+    storage, path, workdir = create_simulation_storage(args)
+    main.set_storage(storage)
+    main.init_db()
+
+    rng = random.Random(args.seed)
+    bot = SimulatedBot(args.latency / 1000, args.failure_rate, args.seed)
+    schedules = create_synthetic_chats(args.chats, args.days, rng)
+    print(f"Симуляция: {args.days} дн. с {args.start} ({args.timezone}), чатов {args.chats}, "
+          f"пересылок {args.posts} в день на чат, база {path or storage.name}")
+    print(f"{'день':>4} | {'отправок':>8} | {'тик p95, мс':>11} | {'тик max, мс':>11} | {'база, КБ':>8}")
+
+    durations = []
+    next_message_id = 1
+    sizes = [database_size(storage, path)]
+    started = time.perf_counter()
+    for day in range(args.days):
+        for chat_id, (times, days_offset) in schedules.items():
+            messages = [(-2000000000 - chat_id, next_message_id + i) for i in range(args.posts)]
+            next_message_id += args.posts
+            bot.deleted.update(message for message in messages if rng.random() < args.deleted_rate)
+            main.add_reposts_to_db(chat_id, messages, times, days_offset)
+
+        sent_before = bot.sent
+        day_durations = []
+        day_end = start + timedelta(days=day + 1)
+        while clock.now() < day_end:
+            tick_started = time.perf_counter()
+            main.publish_repost(bot)
+            duration = time.perf_counter() - tick_started
+            day_durations.append(duration)
+            now = clock.now()
+            clock.advance(max(timedelta(seconds=duration),
+                              now.replace(second=0, microsecond=0) + timedelta(minutes=1) - now))
+        durations.extend(day_durations)
+        sizes.append(database_size(storage, path))
+        day_durations.sort()
+        print(f"{day + 1:>4} | {bot.sent - sent_before:>8} | {main.percentile(day_durations, 95) * 1000:>11.2f} | "
+              f"{day_durations[-1] * 1000:>11.2f} | {format_size(sizes[-1]):>8}")
+    elapsed = time.perf_counter() - started
+
+    # Пропущенные слоты: репосты, время отправки которых прошло, а они так и не отправлены
+    last_minute = (main.dispatch_state['cursor'] - timedelta(minutes=1)).strftime('%Y-%m-%d %H:%M')
+    missed_slots = sum(main.storage.count_due_by_minute(start.strftime('%Y-%m-%d %H:%M'), last_minute).values())
+    durations.sort()
+    print(f"Отправок: {bot.sent}, временных ошибок: {bot.failed}, отправок удаленных сообщений: {bot.missing}, "
+          f"уведомлений: {bot.notifications}")
+    print(f"Тиков: {len(durations)}, пропущено слотов: {missed_slots}, "
+          f"максимальное отставание публикации: {main.format_lag(main.dispatch_state['max_lag_seconds'])}")
+    print(f"Тик: p50 {main.percentile(durations, 50) * 1000:.2f} мс, p95 {main.percentile(durations, 95) * 1000:.2f} мс, "
+          f"max {durations[-1] * 1000:.2f} мс")
+    if sizes[0] is not None:
+        print(f"База: {sizes[0] / 1024:.0f} КБ -> {sizes[-1] / 1024:.0f} КБ, "
+              f"в среднем +{(sizes[-1] - sizes[0]) / args.days / 1024:.0f} КБ в день")
+    print(f"Сводка чатов расходится с репостами: {count_summary_mismatches(schedules)} из {len(schedules)}")
+    print(f"Прокручено {args.days} дн. за {elapsed:.1f} с")
+    main.set_clock(main.SystemClock())
+    if workdir:
+        workdir.cleanup()
+
+
+# Пиковая память Python (tracemalloc), выделенная во время func(*args): (результат, пик в байтах)
+def peak_memory(func, *args):
+    tracemalloc.start()
+    try:
+        result = func(*args)
+        return result, tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+
+# Синтетический чат 1 с rows репостами, запланированными раз в минуту начиная со start: каждый десятый
+# опубликован, отправка остальных просрочена и назначена на минуту start (отставание после простоя)
+def create_large_chat(rows, start, chunk_size=50000):
+    dispatch_date = start.strftime('%Y-%m-%d %H:%M')
+    for first in range(0, rows, chunk_size):
+        chunk = []
+        for message_id in range(first, min(first + chunk_size, rows)):
+            publish_date = (start + timedelta(minutes=message_id)).strftime('%Y-%m-%d %H:%M')
+            chunk.append((1, -100, message_id, publish_date[-5:], publish_date, int(message_id % 10 == 0), dispatch_date))
+        main.storage.add_reposts(chunk)
+
+
+# Вывод /list целиком: (число сообщений, символов)
+def run_list():
+    replies = [0, 0]
+
+    def reply_text(text, **kwargs):
+        replies[0] += 1
+        replies[1] += len(text)
+
+    message = SimpleNamespace(chat_id=1, from_user=SimpleNamespace(id=1), reply_text=reply_text)
+    main.list_scheduled_posts(SimpleNamespace(message=message, callback_query=None),
+                              SimpleNamespace(bot=SimulatedBot(0, 0, 0), args=[]))
+    return replies
+
+
+# Первые batches пачек публикации накопленного отставания. Возвращает число отправок
+def run_dispatch(batches):
+    bot = SimulatedBot(0, 0, 0)
+    main.dispatch_state.update(cursor=None, after_id=0)
+    for _ in range(batches):
+        main.publish_next_batch(bot)
+    return bot.sent
+
+
+def benchmark_memory(args):
+    logging.getLogger('main').setLevel(logging.ERROR)
+    logging.getLogger('storage').setLevel(logging.ERROR)
+    start = main.current_timezone.localize(datetime(2030, 1, 1, 10, 0))
+    main.set_clock(SimulatedClock(start))
+
+    print(f"{'репостов':>9} | {'/list, КБ':>9} | {'сообщений':>9} | {'/list, с':>8} | "
+          f"{'публикация, КБ':>14} | {'отправок':>8} | {'публикация, с':>13}")
+    for rows in args.sizes:
+        with tempfile.TemporaryDirectory() as workdir:
+            main.set_storage(SQLiteStorage(os.path.join(workdir, 'reposts.db')))
+            main.init_db()
+            create_large_chat(rows, start)
+
+            started = time.perf_counter()
+            (messages, _), list_peak = peak_memory(run_list)
+            list_seconds = time.perf_counter() - started
+            started = time.perf_counter()
+            sent, dispatch_peak = peak_memory(run_dispatch, args.batches)
+            dispatch_seconds = time.perf_counter() - started
+        print(f"{rows:>9} | {list_peak / 1024:>9.0f} | {messages:>9} | {list_seconds:>8.1f} | "
+              f"{dispatch_peak / 1024:>14.0f} | {sent:>8} | {dispatch_seconds:>13.1f}")
+    main.set_clock(main.SystemClock())
+
+
+def main_cli(argv=None):
+    parser = argparse.ArgumentParser(description="Бенчмарки бота.")
+    benchmarks = parser.add_subparsers(dest='benchmark', required=True)
+    transport = benchmarks.add_parser('transport', help="запросы к Bot API при разных размерах пула соединений")
+    transport.add_argument('--pool-sizes', type=int, nargs='+', default=[1, 2, 4, 8, 16])
+    transport.add_argument('--threads', type=int, default=16, help="число одновременно отправляющих потоков")
+    transport.add_argument('--requests', type=int, default=2000)
+    transport.add_argument('--latency', type=float, default=20, help="задержка ответа сервера, мс")
+    timewarp = benchmarks.add_parser('timewarp', help="запуски публикации за несколько недель на синтетической базе")
+    timewarp.add_argument('--days', type=int, default=30)
+    timewarp.add_argument('--chats', type=int, default=20)
+    timewarp.add_argument('--posts', type=int, default=2, help="пересылок в день на чат")
+    timewarp.add_argument('--start', default=datetime.now().strftime('%Y-%m-%d'), help="первый день, ГГГГ-ММ-ДД")
+    timewarp.add_argument('--timezone', default='Asia/Bishkek')
+    timewarp.add_argument('--latency', type=float, default=0, help="задержка ответа фейкового бота, мс")
+    timewarp.add_argument('--failure-rate', type=float, default=0, help="доля отправок с временной ошибкой")
+    timewarp.add_argument('--deleted-rate', type=float, default=0,
+                          help="доля пересланных сообщений, удаленных в источнике (срабатывает предохранитель)")
+    timewarp.add_argument('--seed', type=int, default=1)
+    timewarp.add_argument('--backend', choices=('sqlite', 'memory', 'postgres'), default='sqlite', help="движок хранилища")
+    timewarp.add_argument('--db', help="путь к новой базе SQLite (по умолчанию временный файл)")
+    timewarp.add_argument('--dsn', help="строка подключения к пустой базе PostgreSQL для --backend postgres")
+    memory = benchmarks.add_parser('memory', help="пиковая память /list и публикации при росте числа репостов")
+    memory.add_argument('--sizes', type=int, nargs='+', default=[10000, 100000, 1000000])
+    memory.add_argument('--batches', type=int, default=5, help="пачек публикации на замер")
+    args = parser.parse_args(argv)
+
+    if args.benchmark == 'transport':
+        benchmark_transport(args)
+    elif args.benchmark == 'timewarp':
+        benchmark_timewarp(args)
+    elif args.benchmark == 'memory':
+        benchmark_memory(args)
+
+
+if __name__ == '__main__':
+    main_cli()
@@ -1,4 +1,54 @@
-# config.py
-
-# Токен вашего Telegram-бота
-BOT_TOKEN = ''
\ No newline at end of file
+# config.py
+
+# Токен вашего Telegram-бота
+BOT_TOKEN = ''
+
+# ID пользователей Telegram, которым доступны административные команды (например, /profile)
+ADMIN_IDS = []
+
+# Хранилище данных: 'sqlite' (по умолчанию), 'memory' (в памяти, для бенчмарков) или 'postgres'
+STORAGE_BACKEND = 'sqlite'
+
+# Путь к файлу базы SQLite
+SQLITE_PATH = 'reposts.db'
+
+# Строка подключения и размер пула соединений PostgreSQL (требуется пакет psycopg2-binary).
+# None - по числу потоков, обращающихся к базе: BOT_WORKERS + DELIVERY_WORKERS + 2 (цикл публикации и основной поток).
+# Потоки, которым не хватило соединения, ждут его освобождения
+POSTGRES_DSN = 'dbname=reposts user=postgres host=localhost'
+POSTGRES_POOL_SIZE = None
+
+# Максимальное окно разнесения отправок (в минутах) для команды /set_spread
+SPREAD_MAX_MINUTES = 30
+
+# Пересланные подряд сообщения собираются в одну пачку: пачка сохраняется, когда новых сообщений
+# не было INGEST_DEBOUNCE_SECONDS секунд, но не позже INGEST_MAX_DELAY_SECONDS после первого сообщения
+INGEST_DEBOUNCE_SECONDS = 2
+INGEST_MAX_DELAY_SECONDS = 10
+
+# Bot API: адрес сервера (None - api.telegram.org, например 'http://localhost:8081/bot' для локального сервера Bot API)
+BOT_API_URL = None
+# Число потоков обработки команд и пересланных сообщений (полоса interactive).
+# Пул соединений для получения обновлений и ответов на команды - BOT_WORKERS + 4
+BOT_WORKERS = 4
+# Число потоков публикации репостов (полоса delivery), не пересекающихся с обработкой команд.
+# Репосты одного целевого чата отправляются одним потоком по порядку, разные чаты - параллельно
+DELIVERY_WORKERS = 4
+# Отдельный пул соединений для публикации репостов (по соединению на поток DELIVERY_WORKERS)
+BOT_API_SEND_POOL_SIZE = 4
+# Таймауты подключения и чтения ответа Bot API (секунды) и время ожидания обновлений в long polling
+BOT_API_CONNECT_TIMEOUT = 5.0
+BOT_API_READ_TIMEOUT = 10.0
+BOT_API_POLL_TIMEOUT = 10
+
+# Предохранитель: после стольких постоянных ошибок подряд (канал удален, бот исключен, исходное сообщение удалено)
+# публикации в канал или из сообщения приостанавливаются и проверяются раз в BREAKER_PROBE_MINUTES минут
+BREAKER_FAILURE_THRESHOLD = 3
+BREAKER_PROBE_MINUTES = 60
+
+# Цикл публикации обрабатывает минуты отправки по порядку, от самой старой необработанной,
+# пачками не больше DISPATCH_BATCH_SIZE репостов. При перегрузке минуты не пропускаются - растет отставание
+DISPATCH_BATCH_SIZE = 100
+# Последняя обработанная минута цикла публикации сохраняется в базе. После запуска (в том числе /restart) цикл
+# продолжает со следующей минуты, но догоняет не больше DISPATCH_CATCHUP_MINUTES минут, пропущенных во время остановки
+DISPATCH_CATCHUP_MINUTES = 1440
@@ -1,294 +1,974 @@
 import logging
-from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup
-from telegram.ext import Updater, CommandHandler, CallbackContext, MessageHandler, Filters, CallbackQueryHandler
-from apscheduler.schedulers.background import BackgroundScheduler
+from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup, MessageEntity
+from telegram.ext import Updater, CommandHandler, CallbackContext, MessageHandler, Filters, CallbackQueryHandler, ExtBot
+from telegram.utils.request import Request
 from datetime import datetime, timedelta
-import sqlite3
-from config import BOT_TOKEN
-from telegram.error import BadRequest, TelegramError
+from config import (BOT_TOKEN, ADMIN_IDS, STORAGE_BACKEND, SQLITE_PATH, POSTGRES_DSN, POSTGRES_POOL_SIZE, SPREAD_MAX_MINUTES,
+                    INGEST_DEBOUNCE_SECONDS, INGEST_MAX_DELAY_SECONDS, BOT_API_URL, BOT_WORKERS, DELIVERY_WORKERS,
+                    BOT_API_SEND_POOL_SIZE,
+                    BOT_API_CONNECT_TIMEOUT, BOT_API_READ_TIMEOUT, BOT_API_POLL_TIMEOUT,
+                    BREAKER_FAILURE_THRESHOLD, BREAKER_PROBE_MINUTES, DISPATCH_BATCH_SIZE, DISPATCH_CATCHUP_MINUTES)
+from storage import create_storage, StorageError
+from telegram.error import BadRequest, TelegramError, Unauthorized
 import pytz
 import time
 import os
 import sys
+import csv
+import json
+import argparse
+import tempfile
+import threading
+import functools
+import cProfile
+import pstats
+import io
+import signal
+import zlib
+import math
+import hashlib
+from concurrent.futures import ThreadPoolExecutor
 
 # Настройка логирования
 logger = logging.getLogger(__name__)
-logger.setLevel(logging.DEBUG)
 
 file_handler = logging.FileHandler('bot.log')
 file_handler.setFormatter(logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s'))
-logger.addHandler(file_handler)
 
 stream_handler = logging.StreamHandler()
 stream_handler.setFormatter(logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s'))
-logger.addHandler(stream_handler)
+
+# Логгер хранилища пишет в те же файл и консоль
+for bot_logger in (logger, logging.getLogger('storage')):
+    bot_logger.setLevel(logging.DEBUG)
+    bot_logger.addHandler(file_handler)
+    bot_logger.addHandler(stream_handler)
 
 # Установка временной зоны по умолчанию
 DEFAULT_TIMEZONE = pytz.timezone('Asia/Bishkek')
 current_timezone = DEFAULT_TIMEZONE
 
+# Часы бота: now() - текущее время (с временной зоной), sleep(seconds) - пауза между повторами отправки.
+# Симуляция подставляет свои часы через set_clock и прокручивает недели за секунды
+class SystemClock:
+    def now(self):
+        return datetime.now(pytz.utc)
+
+    def sleep(self, seconds):
+        time.sleep(seconds)
+
+clock = SystemClock()
+
+# Замена часов бота
+def set_clock(new_clock):
+    global clock
+    clock = new_clock
+
 # Получение текущего времени в установленной временной зоне
 def get_current_time():
-    return datetime.now(current_timezone)
+    return clock.now().astimezone(current_timezone)
 
 # Преобразование строки времени в объект datetime с временной зоной
 def parse_time(time_str):
     return current_timezone.localize(datetime.strptime(time_str, '%Y-%m-%d %H:%M'))
 
-# Подключение к базе данных с контекстным менеджером
-def get_db_connection():
+# Профилирование по требованию: следующие N запусков публикации или вызовов обработчиков
+PROFILE_DEFAULT_RUNS = 5
+PROFILE_TOP_N = 25
+profile_lock = threading.Lock()
+profile_state = {'remaining': 0, 'stats': None, 'bot': None, 'chat_id': None}
+profile_local = threading.local()
+
+# Включение профилирования для следующих runs вызовов
+def start_profiling(runs, bot=None, chat_id=None):
+    with profile_lock:
+        profile_state.update(remaining=runs, stats=None, bot=bot, chat_id=chat_id)
+    logger.info(f"Профилирование включено для следующих {runs} вызовов.")
+
+# Декоратор: профилирует вызов, если профилирование включено (вложенные вызовы входят во внешний профиль)
+def profiled(func):
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        if profile_state['remaining'] <= 0 or getattr(profile_local, 'active', False):
+            return func(*args, **kwargs)
+        profiler = cProfile.Profile()
+        try:
+            profiler.enable()
+        except ValueError:  # Python 3.12+: профилировщик уже активен в другом потоке - вызов без профилирования
+            return func(*args, **kwargs)
+        profile_local.active = True
+        profile_local.tasks = []
+        try:
+            return func(*args, **kwargs)
+        finally:
+            profiler.disable()
+            profile_local.active = False
+            collect_profile(profiler, func.__name__, profile_local.tasks)
+    return wrapper
+
+# Функция для выполнения в другом потоке (полосе). cProfile видит только свой поток, поэтому, если вызывающий
+# поток профилируется, задача профилируется отдельно и ее профиль добавляется к профилю внешнего вызова.
+# Задачи должны завершиться до выхода из внешнего вызова
+def profiled_task(func):
+    if not getattr(profile_local, 'active', False):
+        return func
+    tasks = profile_local.tasks
+
+    @functools.wraps(func)
+    def wrapper(*args):
+        profiler = cProfile.Profile()
+        try:
+            profiler.enable()
+        except ValueError:  # Python 3.12+: профилировщик уже активен в другом потоке
+            return func(*args)
+        try:
+            return func(*args)
+        finally:
+            profiler.disable()
+            tasks.append(profiler)
+    return wrapper
+
+# Накопление результатов профилирования (вызов и его задачи в полосах) и выгрузка после последнего вызова
+def collect_profile(profiler, name, tasks=()):
+    with profile_lock:
+        if profile_state['remaining'] <= 0:
+            return
+        if profile_state['stats'] is None:
+            profile_state['stats'] = pstats.Stats(profiler)
+        else:
+            profile_state['stats'].add(profiler)
+        for task_profiler in tasks:
+            profile_state['stats'].add(task_profiler)
+        profile_state['remaining'] -= 1
+        logger.debug(f"Профиль вызова {name} сохранен, осталось вызовов: {profile_state['remaining']}.")
+        if profile_state['remaining'] > 0:
+            return
+        stats, bot, chat_id = profile_state['stats'], profile_state['bot'], profile_state['chat_id']
+        profile_state.update(stats=None, bot=None, chat_id=None)
+
     try:
-        conn = sqlite3.connect('reposts.db', check_same_thread=False)
-        logger.debug("Успешное подключение к базе данных.")
-        return conn
-    except sqlite3.Error as e:
-        logger.error(f"Ошибка при подключении к базе данных: {e}")
-        raise
+        path = f"profile_{datetime.now().strftime('%Y%m%d_%H%M%S')}.prof"
+        stats.dump_stats(path)
+        summary = io.StringIO()
+        stats.stream = summary
+        stats.strip_dirs().sort_stats('cumulative').print_stats(PROFILE_TOP_N)
+        logger.info(f"Профилирование завершено, профиль сохранен в {path}.\n{summary.getvalue()}")
+
+        if bot and chat_id:
+            text = f"Профиль сохранен в {path}. Топ-{PROFILE_TOP_N} по cumulative time:\n{summary.getvalue().strip()}"
+            max_length = 4096  # Максимальная длина сообщения в Telegram
+            for i in range(0, len(text), max_length):
+                bot.send_message(chat_id=chat_id, text=text[i:i + max_length])
+    except Exception as e:
+        logger.error(f"Ошибка при сохранении результатов профилирования: {e}")
+
+# Обработчик сигнала SIGUSR1 - включает профилирование, результат пишется в лог
+def handle_profile_signal(signum, frame):
+    start_profiling(PROFILE_DEFAULT_RUNS)
+
+# Полосы выполнения: interactive - команды и пересланные сообщения, delivery - публикация репостов.
+# У каждой полосы свой ограниченный пул потоков и счетчики очереди, поэтому публикация не задерживает команды
+lanes = {}
+
+# Создание полосы с workers потоками
+def create_lane(name, workers):
+    lanes[name] = {'executor': ThreadPoolExecutor(max_workers=workers, thread_name_prefix=f'lane-{name}'),
+                   'workers': workers, 'lock': threading.Lock(), 'queued': 0, 'running': 0, 'completed': 0,
+                   'max_queued': 0, 'wait_total': 0.0}
+
+# Выполнение func(*args) в полосе name. Возвращает Future
+def submit_to_lane(name, func, *args):
+    lane = lanes[name]
+    submitted = time.monotonic()
+    with lane['lock']:
+        lane['queued'] += 1
+        lane['max_queued'] = max(lane['max_queued'], lane['queued'])
+
+    def run():
+        with lane['lock']:
+            lane['queued'] -= 1
+            lane['running'] += 1
+            lane['wait_total'] += time.monotonic() - submitted
+        try:
+            return func(*args)
+        except Exception as e:
+            logger.error(f"Ошибка в полосе {name} при выполнении {func.__name__}: {e}")
+            raise
+        finally:
+            with lane['lock']:
+                lane['running'] -= 1
+                lane['completed'] += 1
+    return lane['executor'].submit(run)
+
+# Обработчик Telegram, выполняемый в полосе name: диспетчер сразу переходит к следующему обновлению
+def in_lane(name, callback):
+    @functools.wraps(callback)
+    def handler(update, context):
+        submit_to_lane(name, callback, update, context)
+    return handler
+
+# Метрики полос: потоки, глубина очереди (текущая и максимальная), выполняется, выполнено, среднее ожидание
+def lane_stats():
+    stats = {}
+    for name, lane in lanes.items():
+        with lane['lock']:
+            started = lane['completed'] + lane['running']
+            stats[name] = {'workers': lane['workers'], 'queued': lane['queued'], 'max_queued': lane['max_queued'],
+                           'running': lane['running'], 'completed': lane['completed'],
+                           'avg_wait_ms': lane['wait_total'] / started * 1000 if started else 0.0}
+    return stats
+
+create_lane('interactive', BOT_WORKERS)
+create_lane('delivery', DELIVERY_WORKERS)
+
+# Хранилище данных (движок выбирается в config.py). Команды, которые только читают, используют
+# отдельные соединения только для чтения (reader)
+storage = create_storage(STORAGE_BACKEND, SQLITE_PATH, POSTGRES_DSN,
+                         POSTGRES_POOL_SIZE or BOT_WORKERS + DELIVERY_WORKERS + 2)
+reader = storage.reader()
+
+# Замена хранилища (симуляция работает с отдельной синтетической базой)
+def set_storage(new_storage):
+    global storage, reader
+    storage = new_storage
+    reader = storage.reader()
 
 # Инициализация базы данных
 def init_db():
     try:
-        with get_db_connection() as conn:
-            cursor = conn.cursor()
-            cursor.execute('''CREATE TABLE IF NOT EXISTS reposts (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                chat_id INTEGER,
-                from_chat_id INTEGER,
-                message_id INTEGER,
-                publish_time TEXT,
-                publish_date TEXT,
-                is_published INTEGER DEFAULT 0,
-                UNIQUE(chat_id, from_chat_id, message_id, publish_date)
-            )''')
-            cursor.execute('''CREATE TABLE IF NOT EXISTS settings (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                chat_id INTEGER UNIQUE,
-                time1 TEXT,
-                days_offset INTEGER DEFAULT 10,
-                timezone TEXT DEFAULT 'Asia/Bishkek',
-                send_mode TEXT DEFAULT 'forward'
-            )''')
-            cursor.execute('''CREATE TABLE IF NOT EXISTS target_chats (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                chat_id INTEGER UNIQUE,
-                target_chat_id INTEGER,
-                target_chat_username TEXT
-            )''')
-            conn.commit()
-            logger.info("Таблицы 'reposts', 'settings' и 'target_chats' созданы или уже существуют.")
-
-            # Проверка наличия столбца send_mode в таблице settings
-            cursor.execute("PRAGMA table_info(settings)")
-            columns = cursor.fetchall()
-            column_names = [column[1] for column in columns]
-            if 'send_mode' not in column_names:
-                cursor.execute('ALTER TABLE settings ADD COLUMN send_mode TEXT DEFAULT "forward"')
-                conn.commit()
-                logger.info("Столбец 'send_mode' добавлен в таблицу 'settings'.")
-    except sqlite3.Error as e:
+        storage.init()
+    except StorageError as e:
         logger.error(f"Ошибка при инициализации базы данных: {e}")
         raise
 
+# Получение сводки по чату для /info одним запросом по ключу chat_id
+def get_chat_summary(chat_id):
+    try:
+        summary = reader.get_chat_summary(chat_id)
+        settings = summary['settings']
+        target = summary['target'] or {}
+
+        if settings:
+            times = settings['time1'].split(", ") if settings['time1'] else []
+            days_offset, timezone, send_mode = settings['days_offset'], settings['timezone'], settings['send_mode']
+        else:
+            times, days_offset, timezone, send_mode = ["21:35", "21:37"], 10, DEFAULT_TIMEZONE, "forward"  # Значения по умолчанию
+        return {
+            'times': times,
+            'days_offset': days_offset,
+            'timezone': timezone,
+            'send_mode': send_mode,
+            'spread_minutes': (settings['spread_minutes'] or 0) if settings else 0,
+            'target_chat_id': target.get('target_chat_id'),
+            'target_chat_username': target.get('target_chat_username'),
+            'target_chat_title': target.get('target_chat_title'),
+            'pending_count': summary['pending_count'],
+            'published_count': summary['published_count'],
+            'next_due': summary['next_due'],
+            'last_delivery_at': summary['last_delivery_at'],
+            'last_error': summary['last_error'],
+        }
+    except StorageError as e:
+        logger.error(f"Ошибка при получении сводки для чата {chat_id}: {e}")
+        raise
+
+# Запись результата последней доставки в сводку чата
+def record_delivery_result(chat_id, error=None):
+    try:
+        storage.record_delivery_result(chat_id, get_current_time().strftime('%Y-%m-%d %H:%M'), error)
+    except StorageError as e:
+        logger.error(f"Ошибка при сохранении результата доставки для чата {chat_id}: {e}")
+
+# Режимы отправки /set_mode
+SEND_MODES = ("forward", "copy", "snapshot")
+
 # Получение режима отправки
 def get_send_mode(chat_id):
     try:
-        with get_db_connection() as conn:
-            cursor = conn.cursor()
-            cursor.execute('SELECT send_mode FROM settings WHERE chat_id = ?', (chat_id,))
-            mode = cursor.fetchone()
-            if mode:
-                return mode[0]
-            return "forward"  # Режим по умолчанию
-    except sqlite3.Error as e:
+        settings = storage.get_settings(chat_id)
+        if settings:
+            return settings['send_mode']
+        return "forward"  # Режим по умолчанию
+    except StorageError as e:
         logger.error(f"Ошибка при получении режима отправки для чата {chat_id}: {e}")
         return "forward"
 
 # Установка режима отправки
 def set_send_mode(chat_id, mode):
     try:
-        with get_db_connection() as conn:
-            cursor = conn.cursor()
-            cursor.execute('''UPDATE settings SET send_mode = ? WHERE chat_id = ?''', (mode, chat_id))
-            if cursor.rowcount == 0:
-                cursor.execute('''INSERT INTO settings (chat_id, send_mode) VALUES (?, ?)''', (chat_id, mode))
-            conn.commit()
-            logger.info(f"Режим отправки изменен для чата {chat_id}: {mode}")
-    except sqlite3.Error as e:
+        storage.update_settings(chat_id, send_mode=mode)
+        logger.info(f"Режим отправки изменен для чата {chat_id}: {mode}")
+    except StorageError as e:
         logger.error(f"Ошибка при установке режима отправки для чата {chat_id}: {e}")
         raise
 
 # Получение времени публикации и количества дней
 def get_publish_settings(chat_id):
     try:
-        with get_db_connection() as conn:
-            cursor = conn.cursor()
-            cursor.execute('SELECT time1, days_offset, timezone FROM settings WHERE chat_id = ?', (chat_id,))
-            settings = cursor.fetchone()
-            if settings:
-                times_str = settings[0]
-                times = times_str.split(", ") if times_str else []
-                logger.debug(f"Настройки для чата {chat_id}: времена={times}, дней={settings[1]}, временная зона={settings[2]}")
-                return times, settings[1], settings[2]
-            logger.warning(f"Настройки для чата {chat_id} не установлены, используются значения по умолчанию.")
-            return ["21:35", "21:37"], 10, DEFAULT_TIMEZONE  # Значения по умолчанию
-    except sqlite3.Error as e:
+        settings = reader.get_settings(chat_id)
+        if settings:
+            times_str = settings['time1']
+            times = times_str.split(", ") if times_str else []
+            logger.debug(f"Настройки для чата {chat_id}: времена={times}, дней={settings['days_offset']}, временная зона={settings['timezone']}")
+            return times, settings['days_offset'], settings['timezone']
+        logger.warning(f"Настройки для чата {chat_id} не установлены, используются значения по умолчанию.")
+        return ["21:35", "21:37"], 10, DEFAULT_TIMEZONE  # Значения по умолчанию
+    except StorageError as e:
         logger.error(f"Ошибка при получении настроек для чата {chat_id}: {e}")
         return None, None, None
 
 # Установка времени публикации
 def set_publish_times(chat_id, times_str):
     try:
-        with get_db_connection() as conn:
-            cursor = conn.cursor()
-            cursor.execute('''INSERT OR REPLACE INTO settings (chat_id, time1) VALUES (?, ?)''', (chat_id, times_str))
-            conn.commit()
-            logger.info(f"Время публикации установлено для чата {chat_id}: {times_str}")
-    except sqlite3.Error as e:
+        storage.replace_publish_times(chat_id, times_str)
+        logger.info(f"Время публикации установлено для чата {chat_id}: {times_str}")
+    except StorageError as e:
         logger.error(f"Ошибка при установке времени публикации для чата {chat_id}: {e}")
         raise
 
 # Установка количества дней для отложения
 def set_days_offset(chat_id, days_offset):
     try:
-        with get_db_connection() as conn:
-            cursor = conn.cursor()
-            cursor.execute('''UPDATE settings SET days_offset = ? WHERE chat_id = ?''', (days_offset, chat_id))
-            if cursor.rowcount == 0:
-                cursor.execute('''INSERT INTO settings (chat_id, days_offset) VALUES (?, ?)''', (chat_id, days_offset))
-            conn.commit()
-            logger.info(f"Количество дней для отложения установлено для чата {chat_id}: {days_offset}")
-    except sqlite3.Error as e:
+        storage.update_settings(chat_id, days_offset=days_offset)
+        logger.info(f"Количество дней для отложения установлено для чата {chat_id}: {days_offset}")
+    except StorageError as e:
         logger.error(f"Ошибка при установке количества дней для чата {chat_id}: {e}")
         raise
 
+# Установка временной зоны
+def set_chat_timezone(chat_id, timezone):
+    try:
+        storage.update_settings(chat_id, timezone=timezone)
+        logger.info(f"Временная зона установлена для чата {chat_id}: {timezone}")
+    except StorageError as e:
+        logger.error(f"Ошибка при установке временной зоны для чата {chat_id}: {e}")
+        raise
+
 # Установка целевого канала
-def set_target_chat(chat_id, target_chat_id, target_chat_username):
-    try:
-        with get_db_connection() as conn:
-            cursor = conn.cursor()
-            cursor.execute('''INSERT OR REPLACE INTO target_chats (chat_id, target_chat_id, target_chat_username) 
-                              VALUES (?, ?, ?)''', (chat_id, target_chat_id, target_chat_username))
-            conn.commit()
-            logger.info(f"Целевой канал установлен для чата {chat_id}: {target_chat_id} ({target_chat_username})")
-    except sqlite3.Error as e:
+def set_target_chat(chat_id, target_chat_id, target_chat_username, target_chat_title=None):
+    try:
+        storage.set_target(chat_id, target_chat_id, target_chat_username, target_chat_title)
+        logger.info(f"Целевой канал установлен для чата {chat_id}: {target_chat_id} ({target_chat_username})")
+    except StorageError as e:
         logger.error(f"Ошибка при установке целевого канала для чата {chat_id}: {e}")
         raise
 
 # Получение целевого канала
 def get_target_chat(chat_id):
     try:
-        with get_db_connection() as conn:
-            cursor = conn.cursor()
-            cursor.execute('SELECT target_chat_id, target_chat_username FROM target_chats WHERE chat_id = ?', (chat_id,))
-            target_chat = cursor.fetchone()
-            if target_chat:
-                logger.debug(f"Целевой канал для чата {chat_id}: {target_chat[0]} ({target_chat[1]})")
-                return target_chat[0], target_chat[1]
-            logger.warning(f"Целевой канал для чата {chat_id} не установлен.")
-            return None, None
-    except sqlite3.Error as e:
+        target_chat = reader.get_target(chat_id)
+        if target_chat:
+            logger.debug(f"Целевой канал для чата {chat_id}: {target_chat['target_chat_id']} ({target_chat['target_chat_username']})")
+            return target_chat['target_chat_id'], target_chat['target_chat_username']
+        logger.warning(f"Целевой канал для чата {chat_id} не установлен.")
+        return None, None
+    except StorageError as e:
         logger.error(f"Ошибка при получении целевого канала для чата {chat_id}: {e}")
         return None, None
 
-# Добавление репоста в базу данных
-def add_repost_to_db(chat_id, from_chat_id, message_id, times, days_offset):
+# Сохранение названия целевого канала
+def set_target_chat_title(chat_id, target_chat_title):
+    try:
+        storage.set_target_title(chat_id, target_chat_title)
+    except StorageError as e:
+        logger.error(f"Ошибка при сохранении названия целевого канала для чата {chat_id}: {e}")
+
+# Получение окна разнесения отправок (в минутах) для чата
+def get_spread_minutes(chat_id):
+    try:
+        settings = storage.get_settings(chat_id)
+        return (settings['spread_minutes'] or 0) if settings else 0
+    except StorageError as e:
+        logger.error(f"Ошибка при получении окна разнесения для чата {chat_id}: {e}")
+        return 0
+
+# Установка окна разнесения отправок
+def set_spread_minutes(chat_id, spread_minutes):
+    try:
+        storage.update_settings(chat_id, spread_minutes=spread_minutes)
+        logger.info(f"Окно разнесения установлено для чата {chat_id}: ±{spread_minutes} мин.")
+    except StorageError as e:
+        logger.error(f"Ошибка при установке окна разнесения для чата {chat_id}: {e}")
+        raise
+
+# Назначение минуты отправки строкам репостов (последний элемент кортежа, None - назначить).
+# При разнесении строка получает наименее загруженную минуту в пределах ±spread_minutes от своего времени
+# с учетом уже запланированных отправок всех чатов; при равной нагрузке - ближайшую к исходному времени,
+# а направление сдвига детерминированно зависит от сообщения
+def assign_dispatch_dates(rows, spread_minutes):
+    unassigned = [datetime.strptime(row[4], '%Y-%m-%d %H:%M') for row in rows if row[6] is None and not row[5]]
+    if spread_minutes <= 0 or not unassigned:
+        return [row[:6] + (row[6] or row[4],) for row in rows]
+
+    window = timedelta(minutes=spread_minutes)
+    load = storage.count_due_by_minute((min(unassigned) - window).strftime('%Y-%m-%d %H:%M'),
+                                       (max(unassigned) + window).strftime('%Y-%m-%d %H:%M'))
+    now = get_current_time().strftime('%Y-%m-%d %H:%M')
+    width = 2 * spread_minutes + 1
+
+    assigned = []
+    for row in rows:
+        if row[6] is not None or row[5]:
+            assigned.append(row[:6] + (row[6] or row[4],))
+            continue
+        slot = datetime.strptime(row[4], '%Y-%m-%d %H:%M')
+        preference = zlib.crc32(f"{row[0]}:{row[1]}:{row[2]}".encode()) % width
+        candidates = []
+        for offset in range(-spread_minutes, spread_minutes + 1):
+            minute = (slot + timedelta(minutes=offset)).strftime('%Y-%m-%d %H:%M')
+            if minute < now and offset != 0:
+                continue  # Прошедшие минуты не подходят
+            candidates.append((load.get(minute, 0), abs(offset), (offset - preference) % width, minute))
+        dispatch_date = min(candidates)[3]
+        load[dispatch_date] = load.get(dispatch_date, 0) + 1
+        assigned.append(row[:6] + (dispatch_date,))
+    return assigned
+
+# Прогноз нагрузки: количество отправок по минутам на ближайшие days дней из таблицы reposts
+def project_load(days):
+    now = get_current_time()
+    return reader.count_due_by_minute(now.strftime('%Y-%m-%d %H:%M'),
+                                       (now + timedelta(days=days)).strftime('%Y-%m-%d %H:%M'))
+
+# Прогноз нагрузки при разнесении всех отправок на ±spread_minutes тем же жадным правилом,
+# что и assign_dispatch_dates (сначала самые загруженные минуты)
+def spread_load(load, spread_minutes):
+    spread = {}
+    for minute, count in sorted(load.items(), key=lambda item: (-item[1], item[0])):
+        slot = datetime.strptime(minute, '%Y-%m-%d %H:%M')
+        candidates = [(slot + timedelta(minutes=offset)).strftime('%Y-%m-%d %H:%M')
+                      for offset in sorted(range(-spread_minutes, spread_minutes + 1), key=abs)]
+        for _ in range(count):
+            target = min(candidates, key=lambda candidate: spread.get(candidate, 0))
+            spread[target] = spread.get(target, 0) + 1
+    return spread
+
+# Текстовый отчет о нагрузке: всего отправок, активные минуты, пик, 95-й перцентиль и самые загруженные минуты
+def format_load_report(title, load, top_n=5):
+    if not load:
+        return f"{title}: нет запланированных отправок.\n"
+    counts = sorted(load.values())
+    p95 = counts[min(len(counts) - 1, int(len(counts) * 0.95))]
+    busiest = sorted(load.items(), key=lambda item: (-item[1], item[0]))[:top_n]
+    report = (f"{title}:\n"
+              f"- всего отправок: {sum(counts)}, активных минут: {len(counts)}\n"
+              f"- пик: {counts[-1]} в минуту, p95: {p95} в минуту\n"
+              f"- самые загруженные минуты:\n")
+    for minute, count in busiest:
+        report += f"  {minute} - {count}\n"
+    return report
+
+# Отчет симуляции: текущая нагрузка и нагрузка при разнесении на ±spread_minutes
+def simulate_load(days, spread_minutes):
+    load = project_load(days)
+    report = format_load_report(f"📈 Текущая нагрузка на {days} дн.", load)
+    if spread_minutes > 0:
+        report += "\n" + format_load_report(f"📉 С разнесением ±{spread_minutes} мин.", spread_load(load, spread_minutes))
+    return report
+
+# Добавление пачки репостов (список пар (from_chat_id, message_id)) в базу данных одной транзакцией
+@profiled
+def add_reposts_to_db(chat_id, messages, times, days_offset):
     try:
         now = get_current_time()
-        with get_db_connection() as conn:
-            cursor = conn.cursor()
+        rows = []
+        for from_chat_id, message_id in messages:
             for day_offset in range(days_offset):
                 for time_str in times:
                     publish_date = (now + timedelta(days=day_offset)).strftime('%Y-%m-%d') + f' {time_str}'
                     publish_date = parse_time(publish_date)
-                    cursor.execute('''
-                        INSERT OR IGNORE INTO reposts (chat_id, from_chat_id, message_id, publish_time, publish_date) 
-                        VALUES (?, ?, ?, ?, ?)
-                    ''', (chat_id, from_chat_id, message_id, time_str, publish_date.strftime('%Y-%m-%d %H:%M')))
-            conn.commit()
-            logger.info(f"Репост добавлен в чат {chat_id} из чата {from_chat_id}. "
-                        f"ID сообщения: {message_id}. Публикации запланированы на {days_offset} дней.")
-            logger.info(f"Время публикации: {times}.")
-    except sqlite3.Error as e:
-        logger.error(f"Ошибка при добавлении репоста в базу данных: {e}")
+                    rows.append((chat_id, from_chat_id, message_id, time_str, publish_date.strftime('%Y-%m-%d %H:%M'), 0, None))
+        added = storage.add_reposts(assign_dispatch_dates(rows, get_spread_minutes(chat_id)))
+        logger.info(f"В чат {chat_id} добавлено {len(messages)} репостов ({added} публикаций). "
+                    f"Публикации запланированы на {days_offset} дней.")
+        logger.info(f"Время публикации: {times}.")
+        return added
+    except StorageError as e:
+        logger.error(f"Ошибка при добавлении репостов в базу данных: {e}")
         raise
 
-# Публикация репоста
-def publish_repost(bot):
+# Буферы пересланных сообщений по чатам: пачка сохраняется одной транзакцией с одним ответом
+ingest_lock = threading.Lock()
+ingest_buffers = {}
+
+# Добавление пересланного сообщения в буфер чата с отложенным сохранением
+def buffer_forwarded_message(message, from_chat_id, message_id):
+    chat_id = message.chat_id
+    with ingest_lock:
+        buffer = ingest_buffers.get(chat_id)
+        if buffer is None:
+            buffer = ingest_buffers[chat_id] = {'messages': [], 'snapshots': {}, 'reply_to': message,
+                                                'started': time.monotonic(), 'timer': None}
+        if (from_chat_id, message_id) not in buffer['messages']:
+            buffer['messages'].append((from_chat_id, message_id))
+        snapshot = message_snapshot(message)
+        if snapshot is not None:
+            buffer['snapshots'][(from_chat_id, message_id)] = snapshot
+
+        # Каждое новое сообщение откладывает сохранение, но не дальше INGEST_MAX_DELAY_SECONDS от первого
+        if buffer['timer']:
+            buffer['timer'].cancel()
+        delay = min(INGEST_DEBOUNCE_SECONDS, buffer['started'] + INGEST_MAX_DELAY_SECONDS - time.monotonic())
+        buffer['timer'] = threading.Timer(max(delay, 0), submit_to_lane, args=['interactive', flush_ingest_buffer, chat_id])
+        buffer['timer'].start()
+
+# Сохранение накопленной пачки пересланных сообщений чата и один итоговый ответ
+def flush_ingest_buffer(chat_id):
+    with ingest_lock:
+        buffer = ingest_buffers.pop(chat_id, None)
+    if not buffer:
+        return
+    if buffer['timer']:
+        buffer['timer'].cancel()
+
+    reply_to, messages = buffer['reply_to'], buffer['messages']
     try:
-        with get_db_connection() as conn:
-            cursor = conn.cursor()
-            current_time = get_current_time().strftime('%Y-%m-%d %H:%M')
-            logger.info(f"Планировщик запущен. Текущее время: {current_time}")
-
-            cursor.execute('''SELECT reposts.chat_id, reposts.from_chat_id, reposts.message_id, 
-                                     reposts.publish_time, reposts.publish_date, target_chats.target_chat_id
-                              FROM reposts
-                              LEFT JOIN target_chats ON reposts.chat_id = target_chats.chat_id
-                              WHERE reposts.is_published = 0 AND reposts.publish_date = ?''', (current_time,))
-            reposts = cursor.fetchall()
-
-            if not reposts:
-                logger.info("Нет репостов для публикации.")
-                return
+        times, days_offset, _ = get_publish_settings(chat_id)
+        if not times or days_offset is None:
+            reply_to.reply_text(
+                "Настройки времени публикации или количества дней не установлены. "
+                "Используйте команды /set_time и /day для настройки."
+            )
+            logger.warning(f"Настройки времени публикации или количества дней не установлены для чата {chat_id}.")
+            return
 
-            for repost in reposts:
-                chat_id, from_chat_id, message_id, publish_time, publish_date, target_chat_id = repost
-                logger.info(f"Обработка репоста для публикации: {repost}")
-                try:
-                    if target_chat_id is None:
-                        target_chat_id = chat_id
-
-                    try:
-                        bot.get_chat(target_chat_id)
-                        logger.info(f"Бот имеет доступ к целевому чату: {target_chat_id}.")
-                    except BadRequest as e:
-                        logger.error(f"Бот не имеет доступа к целевому чату {target_chat_id}: {e}")
-                        continue
-
-                    mode = get_send_mode(chat_id)
-
-                    max_attempts = 3
-                    for attempt in range(max_attempts):
-                        try:
-                            if mode == "forward":
-                                bot.copy_message(chat_id=target_chat_id, from_chat_id=from_chat_id, message_id=message_id)
-                                logger.info(f"Опубликован репост (forward как новое сообщение): {message_id} из чата {from_chat_id} в канал {target_chat_id}.")
-                            elif mode == "copy":
-                                bot.copy_message(chat_id=target_chat_id, from_chat_id=from_chat_id, message_id=message_id)
-                                logger.info(f"Опубликован репост (copy как новое сообщение): {message_id} из чата {from_chat_id} в канал {target_chat_id}.")
-                            else:
-                                logger.error(f"Неизвестный режим отправки: {mode}")
-                                continue
-
-                            cursor.execute('''UPDATE reposts SET is_published = 1 
-                                              WHERE chat_id = ? AND from_chat_id = ? AND message_id = ? AND publish_date = ?''', 
-                                          (chat_id, from_chat_id, message_id, publish_date))
-                            conn.commit()
-                            break
-                        except BadRequest as e:
-                            if "Message to forward not found" in str(e):
-                                logger.error(f"Сообщение {message_id} не найдено. Попытка {attempt + 1} из {max_attempts}.")
-                                if attempt == max_attempts - 1:
-                                    logger.error(f"Сообщение {message_id} не найдено после {max_attempts} попыток. Пропускаем.")
-                            elif "Chat not found" in str(e):
-                                logger.error(f"Целевой чат {target_chat_id} не найден.")
-                                break
-                            else:
-                                logger.error(f"Ошибка при публикации репоста: {e}")
-                        except TelegramError as e:
-                            logger.error(f"Ошибка Telegram API при публикации репоста: {e}")
-                        except Exception as e:
-                            logger.error(f"Ошибка при публикации репоста: {e}")
-
-                        time.sleep(5)
-
-                except Exception as e:
-                    logger.error(f"Ошибка при обработке репоста: {e}")
-            conn.commit()
-    except sqlite3.Error as e:
+        # В режиме snapshot содержимое сохраняется до постановки в расписание
+        if buffer['snapshots'] and get_send_mode(chat_id) == "snapshot":
+            save_snapshots(buffer['snapshots'])
+        added = add_reposts_to_db(chat_id, messages, times, days_offset)
+        reply_to.reply_text(
+            f"Добавлено в расписание сообщений: {len(messages)} × {len(times)} времени × {days_offset} дней "
+            f"(новых публикаций: {added}). Время публикации: {', '.join(times)}."
+        )
+        logger.info(f"{len(messages)} пересланных сообщений добавлено в расписание для чата {chat_id}.")
+    except StorageError as e:
+        logger.error(f"Ошибка базы данных при сохранении пересланных сообщений для чата {chat_id}: {e}")
+        reply_to.reply_text("Произошла ошибка при обработке сообщений.")
+    except Exception as e:
+        logger.error(f"Ошибка при сохранении пересланных сообщений для чата {chat_id}: {e}")
+        reply_to.reply_text("Произошла ошибка при обработке сообщений.")
+
+# Типы медиа в снимке содержимого: поле сообщения и метод отправки send_<тип>.
+# animation проверяется раньше document: у GIF заполнены оба поля
+SNAPSHOT_MEDIA_TYPES = ('photo', 'video', 'animation', 'document', 'audio', 'voice', 'video_note', 'sticker')
+
+# Снимок содержимого сообщения: текст или подпись с entities и file_id медиа.
+# None - содержимое не поддерживается (опросы, геопозиции и т. п.), такие репосты отправляются через copy_message
+def message_snapshot(message):
+    for media_type in SNAPSHOT_MEDIA_TYPES:
+        media = getattr(message, media_type, None)
+        if not media:
+            continue
+        if media_type == 'photo':
+            media = media[-1]  # Самый большой размер
+        snapshot = {'type': media_type, 'file_id': media.file_id}
+        if message.caption:
+            snapshot['caption'] = message.caption
+            snapshot['caption_entities'] = [entity.to_dict() for entity in message.caption_entities]
+        return snapshot
+    if message.text:
+        return {'type': 'text', 'text': message.text, 'entities': [entity.to_dict() for entity in message.entities]}
+    return None
+
+# Сохранение снимков {(from_chat_id, message_id): snapshot}. Ключ содержимого - sha256 канонического JSON,
+# поэтому одинаковое содержимое из разных чатов хранится один раз
+def save_snapshots(snapshots):
+    entries = []
+    for (from_chat_id, message_id), snapshot in snapshots.items():
+        content = json.dumps(snapshot, ensure_ascii=False, sort_keys=True, separators=(',', ':'))
+        entries.append((from_chat_id, message_id, hashlib.sha256(content.encode()).hexdigest(), content))
+    storage.add_contents(entries)
+    logger.info(f"Сохранено снимков содержимого: {len(entries)}.")
+
+# Отправка снимка содержимого методом, соответствующим его типу. Возвращает (сообщение, имя метода)
+def send_snapshot(bot, chat_id, content):
+    snapshot = json.loads(content)
+    if snapshot['type'] == 'text':
+        entities = MessageEntity.de_list(snapshot['entities'], bot)
+        return bot.send_message(chat_id=chat_id, text=snapshot['text'], entities=entities), 'send_message'
+
+    method = f"send_{snapshot['type']}"
+    kwargs = {snapshot['type']: snapshot['file_id']}
+    if 'caption' in snapshot:
+        kwargs.update(caption=snapshot['caption'], caption_entities=MessageEntity.de_list(snapshot['caption_entities'], bot))
+    return getattr(bot, method)(chat_id=chat_id, **kwargs), method
+
+# Немедленное сохранение всех буферов (перед перезапуском)
+def flush_all_ingest_buffers():
+    with ingest_lock:
+        chat_ids = list(ingest_buffers)
+    for chat_id in chat_ids:
+        flush_ingest_buffer(chat_id)
+
+# Состояние цикла публикации: cursor - самая старая необработанная минута отправки, after_id - последний
+# обработанный репост этой минуты; lag_seconds - отставание от реального времени при последней пачке
+dispatch_lock = threading.Lock()
+dispatch_state = {'cursor': None, 'after_id': 0, 'lag_seconds': 0.0, 'max_lag_seconds': 0.0,
+                  'minutes': 0, 'batches': 0, 'sent': 0, 'last_run_seconds': 0.0}
+
+# Публикация репостов: все минуты отправки от самой старой необработанной до текущей, по порядку и пачками
+# не больше DISPATCH_BATCH_SIZE. Минуты не пропускаются, даже если предыдущий запуск длился дольше минуты.
+# Одновременно выполняется только один запуск
+@profiled
+def publish_repost(bot):
+    if not dispatch_lock.acquire(blocking=False):
+        logger.warning("Предыдущий запуск публикации еще выполняется.")
+        return
+    try:
+        started = time.monotonic()
+        while publish_next_batch(bot):
+            pass
+        dispatch_state['last_run_seconds'] = time.monotonic() - started
+    finally:
+        dispatch_lock.release()
+
+# Публикация следующей пачки самой старой необработанной минуты. Возвращает False, когда обработаны все минуты
+def publish_next_batch(bot):
+    try:
+        now = get_current_time()
+        current_minute = now.replace(second=0, microsecond=0)
+        cursor = dispatch_state['cursor']
+        if cursor is None:
+            # Первый запуск после старта процесса: догоняются минуты, пропущенные во время остановки
+            cursor = initial_dispatch_cursor(current_minute)
+            dispatch_state.update(cursor=cursor, after_id=0)
+        elif cursor > current_minute + timedelta(minutes=1):
+            # Часы переведены назад
+            cursor = current_minute
+            dispatch_state.update(cursor=cursor, after_id=0)
+        if cursor > current_minute:
+            return False
+
+        lag_seconds = (now - cursor).total_seconds()
+        dispatch_state['lag_seconds'] = lag_seconds
+        dispatch_state['max_lag_seconds'] = max(dispatch_state['max_lag_seconds'], lag_seconds)
+        if lag_seconds >= 120:
+            logger.warning(f"Публикация отстает от реального времени на {format_lag(lag_seconds)}.")
+
+        dispatch_date = cursor.astimezone(current_timezone).strftime('%Y-%m-%d %H:%M')
+        logger.info(f"Публикация репостов минуты {dispatch_date}. Текущее время: {now.strftime('%Y-%m-%d %H:%M')}")
+        # Предохранители читаются до захвата: после claim_due пачка должна быть передана в отправку
+        breakers = storage.get_breakers()
+        reposts = storage.claim_due(dispatch_date, dispatch_state['after_id'], DISPATCH_BATCH_SIZE)
+        dispatch_state['batches'] += 1
+
+        if reposts:
+            publish_batch(bot, reposts, dispatch_date, breakers)
+            dispatch_state['sent'] += len(reposts)
+        else:
+            logger.info("Нет репостов для публикации.")
+
+        # Курсор сдвигается только после отправки пачки. Неполная пачка - минута обработана полностью
+        # и сохраняется как последняя обработанная, чтобы после перезапуска продолжить со следующей
+        if len(reposts) < DISPATCH_BATCH_SIZE:
+            dispatch_state.update(cursor=cursor + timedelta(minutes=1), after_id=0)
+            dispatch_state['minutes'] += 1
+            storage.set_dispatch_cursor(dispatch_date)
+        else:
+            dispatch_state['after_id'] = reposts[-1][0]
+        return True
+    except StorageError as e:
+        # Минута остается необработанной и повторится при следующем запуске
         logger.error(f"Ошибка базы данных при публикации репостов: {e}")
+        return False
+
+# Начальная минута цикла публикации: следующая за последней обработанной до остановки (сохраненный курсор),
+# но не раньше DISPATCH_CATCHUP_MINUTES минут назад. Без сохраненного курсора или при переводе часов назад - текущая
+def initial_dispatch_cursor(current_minute):
+    last_minute = storage.get_dispatch_cursor()
+    if last_minute is None:
+        return current_minute
+    cursor = max(parse_time(last_minute) + timedelta(minutes=1),
+                 current_minute - timedelta(minutes=DISPATCH_CATCHUP_MINUTES))
+    if cursor > current_minute:
+        return current_minute
+    if cursor < current_minute:
+        logger.info(f"Публикация продолжается с минуты {cursor.strftime('%Y-%m-%d %H:%M')} "
+                    f"(последняя обработанная до остановки: {last_minute}).")
+    return cursor
+
+# Цикл публикации: запуск publish_repost в начале каждой минуты до установки stop_event.
+# Запуск, длившийся дольше минуты, не пропускает минуты: следующий начинается сразу и догоняет отставание
+def run_dispatch_loop(bot, stop_event):
+    logger.info("Цикл публикации запущен.")
+    while not stop_event.is_set():
+        try:
+            publish_repost(bot)
+        except Exception as e:
+            # Ошибка одного запуска не останавливает цикл: необработанная минута повторится в следующем
+            logger.error(f"Ошибка при публикации репостов: {e}")
+        now = get_current_time()
+        stop_event.wait(60 - now.second - now.microsecond / 1000000)
+    logger.info("Цикл публикации остановлен.")
+
+# Состояние цикла публикации для администраторов: отставание, необработанные минуты, пачки
+def format_dispatch_status():
+    cursor = dispatch_state['cursor']
+    if cursor is None:
+        return "🚚 Цикл публикации еще не запускался."
+    backlog = max(0, int((get_current_time() - cursor).total_seconds() // 60) + 1)
+    return (f"🚚 Цикл публикации: отставание {format_lag(dispatch_state['lag_seconds'])} "
+            f"(максимум {format_lag(dispatch_state['max_lag_seconds'])}), необработанных минут: {backlog}, "
+            f"последний запуск {dispatch_state['last_run_seconds']:.1f}с; "
+            f"обработано минут {dispatch_state['minutes']}, пачек {dispatch_state['batches']}, "
+            f"репостов {dispatch_state['sent']}")
+
+# Публикация пачки захваченных репостов минуты отправки dispatch_date. Репосты группируются по целевому чату:
+# одна задача полосы delivery на чат отправляет его репосты по порядку id, поэтому порядок в канале сохраняется,
+# а в один чат не уходит несколько сообщений одновременно. Записи журнала доставок сохраняются одной пачкой
+def publish_batch(bot, reposts, dispatch_date, breakers):
+    by_target = {}
+    for repost in reposts:
+        chat_id, target_chat_id = repost[1], repost[6]
+        by_target.setdefault(chat_id if target_chat_id is None else target_chat_id, []).append(repost)
+
+    task = profiled_task(deliver_to_target)
+    futures = [submit_to_lane('delivery', task, bot, target_chat_id, target_reposts, dispatch_date, breakers)
+               for target_chat_id, target_reposts in by_target.items()]
+    entries = []
+    for future in futures:
+        try:
+            entries.extend(future.result())
+        except Exception as e:
+            logger.error(f"Ошибка при публикации репостов: {e}")
+    write_delivery_log(entries)
+
+# Публикация репостов одного целевого чата по порядку: одна проверка доступа get_chat, затем отправки.
+# Возвращает записи журнала доставок
+def deliver_to_target(bot, target_chat_id, reposts, dispatch_date, breakers):
+    checked_targets = {target_chat_id: check_target_access(bot, reposts[0][1], target_chat_id)}
+    entries = [deliver_repost(bot, repost, dispatch_date, breakers, checked_targets) for repost in reposts]
+    return [entry for entry in entries if entry]
+
+# Проверка доступа бота к целевому чату. Возвращает постоянную ошибку доступа или None.
+# Временная ошибка (таймаут, сеть, RetryAfter) не означает отсутствия доступа: результат неизвестен, отправка выполняется
+def check_target_access(bot, chat_id, target_chat_id):
+    try:
+        bot.get_chat(target_chat_id)
+        logger.info(f"Бот имеет доступ к целевому чату: {target_chat_id}.")
+        return None
+    except (BadRequest, Unauthorized) as e:
+        if breaker_kind(e) == 'target':
+            record_breaker_failure(bot, chat_id, 'target', target_chat_id, 0, e)
+        return e
+    except TelegramError as e:
+        logger.warning(f"Не удалось проверить доступ к целевому чату {target_chat_id}, публикуем без проверки: {e}")
+        return None
+
+# Публикация одного репоста с повторами. Возвращает запись журнала доставок
+def deliver_repost(bot, repost, dispatch_date, breakers, checked_targets):
+    repost_id, chat_id, from_chat_id, message_id, publish_time, publish_date, target_chat_id = repost
+    logger.info(f"Обработка репоста для публикации: {repost}")
+    try:
+        if target_chat_id is None:
+            target_chat_id = chat_id
+
+        access_error = checked_targets[target_chat_id]
+        if access_error is not None:
+            logger.error(f"Бот не имеет доступа к целевому чату {target_chat_id}: {access_error}")
+            record_delivery_result(chat_id, access_error)
+            return delivery_log_entry(repost, dispatch_date, target_chat_id, 0, None, None, access_error)
+
+        mode = get_send_mode(chat_id)
+        # Снимок содержимого: отправка без обращения к исходному сообщению. Без снимка - copy_message
+        content = storage.get_content(from_chat_id, message_id) if mode == "snapshot" else None
+
+        max_attempts = 3
+        delivery_error = None
+        sent_message = None
+        method = "copy_message"
+        attempts = 0
+        for attempt in range(max_attempts):
+            attempts = attempt + 1
+            try:
+                if mode == "forward":
+                    sent_message = bot.copy_message(chat_id=target_chat_id, from_chat_id=from_chat_id, message_id=message_id)
+                    logger.info(f"Опубликован репост (forward как новое сообщение): {message_id} из чата {from_chat_id} в канал {target_chat_id}.")
+                elif mode == "copy":
+                    sent_message = bot.copy_message(chat_id=target_chat_id, from_chat_id=from_chat_id, message_id=message_id)
+                    logger.info(f"Опубликован репост (copy как новое сообщение): {message_id} из чата {from_chat_id} в канал {target_chat_id}.")
+                elif mode == "snapshot" and content is not None:
+                    sent_message, method = send_snapshot(bot, target_chat_id, content)
+                    logger.info(f"Опубликован репост (snapshot через {method}): {message_id} из чата {from_chat_id} в канал {target_chat_id}.")
+                elif mode == "snapshot":
+                    # Сообщение переслано до включения режима snapshot - снимка нет
+                    sent_message = bot.copy_message(chat_id=target_chat_id, from_chat_id=from_chat_id, message_id=message_id)
+                    logger.info(f"Опубликован репост (snapshot без снимка, copy): {message_id} из чата {from_chat_id} в канал {target_chat_id}.")
+                else:
+                    logger.error(f"Неизвестный режим отправки: {mode}")
+                    delivery_error = ValueError(f"Неизвестный режим отправки: {mode}")
+                    break
+
+                storage.mark_published(repost_id)
+                record_delivery_result(chat_id)
+                reset_breakers(bot, chat_id, breakers, ('target', target_chat_id, 0), ('source', from_chat_id, message_id))
+                delivery_error = None
+                break
+            except BadRequest as e:
+                delivery_error = e
+                kind = breaker_kind(e)
+                if kind == 'source':
+                    # Удаленное сообщение не появится при повторе
+                    logger.error(f"Сообщение {message_id} из чата {from_chat_id} не найдено. Пропускаем.")
+                    record_breaker_failure(bot, chat_id, 'source', from_chat_id, message_id, e)
+                    break
+                elif kind == 'target':
+                    logger.error(f"Целевой чат {target_chat_id} недоступен: {e}")
+                    checked_targets[target_chat_id] = e
+                    record_breaker_failure(bot, chat_id, 'target', target_chat_id, 0, e)
+                    break
+                else:
+                    logger.error(f"Ошибка при публикации репоста: {e}")
+            except Unauthorized as e:
+                delivery_error = e
+                logger.error(f"Бот удален из целевого чата {target_chat_id} или заблокирован: {e}")
+                checked_targets[target_chat_id] = e
+                record_breaker_failure(bot, chat_id, 'target', target_chat_id, 0, e)
+                break
+            except TelegramError as e:
+                delivery_error = e
+                logger.error(f"Ошибка Telegram API при публикации репоста: {e}")
+            except Exception as e:
+                delivery_error = e
+                logger.error(f"Ошибка при публикации репоста: {e}")
+
+            clock.sleep(5)
+
+        if delivery_error is not None:
+            record_delivery_result(chat_id, delivery_error)
+        return delivery_log_entry(repost, dispatch_date, target_chat_id, attempts, method, sent_message, delivery_error)
     except Exception as e:
-        logger.error(f"Ошибка при публикации репостов: {e}")
+        logger.error(f"Ошибка при обработке репоста: {e}")
+        return None
+
+# Вид постоянной ошибки доставки: 'target' - целевой чат удален или недоступен боту,
+# 'source' - исходное сообщение удалено, None - ошибка может быть временной
+def breaker_kind(error):
+    text = str(error).lower()
+    if isinstance(error, Unauthorized) or 'chat not found' in text or 'not enough rights' in text:
+        return 'target'
+    if isinstance(error, BadRequest) and 'message to' in text and 'not found' in text:
+        return 'source'
+    return None
+
+# Чаты, которым сообщается о предохранителе: для целевого чата - все чаты, публикующие в него
+# (предохранитель цели общий), для источника - чат, чья доставка его сработала
+def breaker_owners(chat_id, kind, ref_id):
+    if kind != 'target':
+        return [chat_id]
+    try:
+        return sorted(set(storage.get_target_owners(ref_id)) | {chat_id})
+    except StorageError as e:
+        logger.error(f"Ошибка при получении чатов целевого канала {ref_id}: {e}")
+        return [chat_id]
+
+# Учет постоянной ошибки предохранителем. При срабатывании цель или источник исключаются из публикации
+# до проверки через BREAKER_PROBE_MINUTES минут, а чаты-владельцы получают по одному уведомлению
+def record_breaker_failure(bot, chat_id, kind, ref_id, message_id, error):
+    try:
+        probe_at = (get_current_time() + timedelta(minutes=BREAKER_PROBE_MINUTES)).strftime('%Y-%m-%d %H:%M')
+        if not storage.record_breaker_failure(kind, ref_id, message_id, error, BREAKER_FAILURE_THRESHOLD, probe_at):
+            return
+        if kind == 'target':
+            text = f"⚠️ Целевой канал {ref_id} недоступен: {error}. Публикации в него приостановлены"
+        else:
+            text = f"⚠️ Сообщение {message_id} из чата {ref_id} недоступно: {error}. Его публикации приостановлены"
+        logger.warning(f"Сработал предохранитель ({kind} {ref_id}/{message_id}) для чата {chat_id}: {error}")
+        for owner_id in breaker_owners(chat_id, kind, ref_id):
+            notify_chat(bot, owner_id, f"{text}, проверка раз в {BREAKER_PROBE_MINUTES} мин.")
+    except StorageError as e:
+        logger.error(f"Ошибка при учете ошибки доставки ({kind} {ref_id}/{message_id}): {e}")
+
+# Сброс предохранителей цели и источника после успешной отправки; о восстановлении отключенных сообщается чату
+def reset_breakers(bot, chat_id, breakers, *keys):
+    for key in keys:
+        disabled = breakers.pop(key, None)
+        if disabled is None:
+            continue
+        try:
+            storage.reset_breaker(*key)
+        except StorageError as e:
+            logger.error(f"Ошибка при сбросе предохранителя {key}: {e}")
+            continue
+        if disabled:
+            kind, ref_id, message_id = key
+            logger.info(f"Предохранитель ({kind} {ref_id}/{message_id}) сброшен для чата {chat_id}.")
+            if kind == 'target':
+                for owner_id in breaker_owners(chat_id, kind, ref_id):
+                    notify_chat(bot, owner_id, f"✅ Целевой канал {ref_id} снова доступен, публикации возобновлены.")
+            else:
+                notify_chat(bot, chat_id, f"✅ Сообщение {message_id} из чата {ref_id} снова доступно, публикации возобновлены.")
+
+# Служебное уведомление чату (ошибки отправки только логируются)
+def notify_chat(bot, chat_id, text):
+    try:
+        bot.send_message(chat_id=chat_id, text=text)
+    except TelegramError as e:
+        logger.warning(f"Не удалось отправить уведомление в чат {chat_id}: {e}")
+
+# Запись журнала доставок: запланированное и фактическое время, попытки, метод, id сообщения, класс ошибки.
+# Запланированное время - минута отправки dispatch_date (с учетом разнесения), а не publish_date,
+# иначе в задержку попадает намеренное смещение /set_spread
+def delivery_log_entry(repost, dispatch_date, target_chat_id, attempts, method, sent_message, error):
+    repost_id, chat_id = repost[:2]
+    return (repost_id, chat_id, target_chat_id, dispatch_date, get_current_time().strftime('%Y-%m-%d %H:%M:%S'),
+            attempts, method, sent_message.message_id if sent_message and error is None else None,
+            type(error).__name__ if error is not None else None)
+
+# Сохранение записей журнала доставок одной транзакцией
+def write_delivery_log(entries):
+    if not entries:
+        return
+    try:
+        storage.add_delivery_log(entries)
+    except StorageError as e:
+        logger.error(f"Ошибка при записи журнала доставок ({len(entries)} записей): {e}")
+
+# Перцентиль p (0-100) отсортированного списка методом ближайшего ранга
+def percentile(values, p):
+    return values[max(0, math.ceil(len(values) * p / 100) - 1)]
+
+# Форматирование задержки в секундах (отрицательная - отправка раньше запланированного)
+def format_lag(seconds):
+    seconds = int(round(seconds))
+    sign = "-" if seconds < 0 else ""
+    minutes, seconds = divmod(abs(seconds), 60)
+    return f"{sign}{minutes}м{seconds:02d}с" if minutes else f"{sign}{seconds}с"
+
+# Отчет о задержках доставки за последние days дней: p50/p95/p99 задержки от запланированного времени
+# до фактической отправки и доля ошибок - всего, по чатам и по часам запланированного времени
+def delivery_lag_report(days, top_n=10):
+    since = (get_current_time() - timedelta(days=days)).strftime('%Y-%m-%d %H:%M:%S')
+    total = ([], [0])  # (задержки успешных отправок, [число ошибок])
+    by_chat, by_hour = {}, {}
+    for _, chat_id, _, scheduled_at, sent_at, _, _, _, error_class in reader.iter_delivery_log(since):
+        lag = (datetime.strptime(sent_at, '%Y-%m-%d %H:%M:%S') -
+               datetime.strptime(scheduled_at, '%Y-%m-%d %H:%M')).total_seconds()
+        for lags, failures in (total, by_chat.setdefault(chat_id, ([], [0])),
+                               by_hour.setdefault(scheduled_at[11:13], ([], [0]))):
+            if error_class is None:
+                lags.append(lag)
+            else:
+                failures[0] += 1
+
+    def line(name, lags, failures):
+        total = len(lags) + failures[0]
+        lags.sort()
+        quantiles = (f"p50 {format_lag(percentile(lags, 50))}, p95 {format_lag(percentile(lags, 95))}, "
+                     f"p99 {format_lag(percentile(lags, 99))}" if lags else "нет успешных отправок")
+        return f"{name}: {total} отправок, {quantiles}, ошибок {failures[0] / total:.1%}\n"
+
+    lags, failures = total
+    if not lags and not failures[0]:
+        return f"Нет доставок за последние {days} дн."
+    report = f"⏱ Задержка доставки за {days} дн.\n" + line("Всего", lags, failures)
+    report += "\n📌 По чатам (самые активные):\n"
+    for chat_id, (lags, failures) in sorted(by_chat.items(), key=lambda item: -(len(item[1][0]) + item[1][1][0]))[:top_n]:
+        report += line(str(chat_id), lags, failures)
+    report += "\n🕒 По часам запланированного времени:\n"
+    for hour, (lags, failures) in sorted(by_hour.items()):
+        report += line(f"{hour}:00", lags, failures)
+    return report
 
 # Удаление репоста из базы данных по номерам
 def delete_repost_by_numbers(update: Update, context: CallbackContext):
@@ -309,49 +989,36 @@ def delete_repost_by_numbers(update: Update, context: CallbackContext):
             logger.warning(f"Неверный формат номеров: {args}")
             return
 
-        with get_db_connection() as conn:
-            cursor = conn.cursor()
-            # Получаем только неопубликованные репосты для данного чата
-            cursor.execute('''
-                SELECT id, from_chat_id, message_id, publish_date 
-                FROM reposts 
-                WHERE chat_id = ? AND is_published = 0
-                ORDER BY publish_date
-            ''', (chat_id,))
-            reposts = cursor.fetchall()
-
-            if not reposts:
-                update.message.reply_text("Нет неопубликованных репостов для удаления.")
-                logger.info(f"Для чата {chat_id} нет неопубликованных репостов.")
-                return
+        # Получаем ID только неопубликованных репостов для данного чата
+        repost_ids = [repost[0] for repost in storage.iter_reposts(chat_id, published=False)]
 
-            # Создаем список ID репостов
-            repost_ids = [repost[0] for repost in reposts]
+        if not repost_ids:
+            update.message.reply_text("Нет неопубликованных репостов для удаления.")
+            logger.info(f"Для чата {chat_id} нет неопубликованных репостов.")
+            return
 
-            # Удаляем репосты по номерам
-            deleted_count = 0
-            for number in numbers:
-                if number < 1 or number > len(repost_ids):
-                    update.message.reply_text(f"Номер {number} вне диапазона. Доступные номера: от 1 до {len(repost_ids)}.")
-                    logger.warning(f"Номер {number} вне диапазона для чата {chat_id}.")
-                    continue
+        # Выбираем репосты по номерам
+        ids_to_delete = []
+        for number in numbers:
+            if number < 1 or number > len(repost_ids):
+                update.message.reply_text(f"Номер {number} вне диапазона. Доступные номера: от 1 до {len(repost_ids)}.")
+                logger.warning(f"Номер {number} вне диапазона для чата {chat_id}.")
+                continue
 
-                # Получаем ID репоста по номеру (номера начинаются с 1, поэтому number - 1)
-                repost_id = repost_ids[number - 1]
-                cursor.execute('DELETE FROM reposts WHERE id = ?', (repost_id,))
-                deleted_count += 1
-                logger.info(f"Удален репост {repost_id} для чата {chat_id}.")
+            # Получаем ID репоста по номеру (номера начинаются с 1, поэтому number - 1)
+            ids_to_delete.append(repost_ids[number - 1])
 
-            conn.commit()
+        deleted_count = storage.delete_reposts(ids_to_delete)
+        logger.info(f"Удалены репосты {ids_to_delete} для чата {chat_id}.")
 
-            if deleted_count > 0:
-                update.message.reply_text(f"Удалено {deleted_count} неопубликованных репостов.")
-                logger.info(f"Удалено {deleted_count} неопубликованных репостов для чата {chat_id}.")
-            else:
-                update.message.reply_text("Не удалено ни одного неопубликованного репоста.")
-                logger.info(f"Не удалено ни одного неопубликованного репоста для чата {chat_id}.")
+        if deleted_count > 0:
+            update.message.reply_text(f"Удалено {deleted_count} неопубликованных репостов.")
+            logger.info(f"Удалено {deleted_count} неопубликованных репостов для чата {chat_id}.")
+        else:
+            update.message.reply_text("Не удалено ни одного неопубликованного репоста.")
+            logger.info(f"Не удалено ни одного неопубликованного репоста для чата {chat_id}.")
 
-    except sqlite3.Error as e:
+    except StorageError as e:
         logger.error(f"Ошибка базы данных при удалении репостов: {e}")
         update.message.reply_text("Произошла ошибка при удалении репостов.")
     except Exception as e:
@@ -388,7 +1055,10 @@ def start(update: Update, context: CallbackContext):
             "🧹 /clear_sent - удалить все отправленные репосты\n"
             "🚮 /clear_all - удалить все репосты (отправленные и запланированные)\n"
             "🌍 /set_timezone <временная зона> - установить временную зону (например, /set_timezone Asia/Bishkek)\n"
-            "📤 /set_mode <forward/copy> - установить режим отправки (репост или копирование)\n"
+            "📤 /set_mode <forward/copy/snapshot> - установить режим отправки (репост, копирование или снимок содержимого)\n"
+            "↔️ /set_spread <минуты> - разносить отправки на ±N минут, чтобы сгладить пики (0 - выключить)\n"
+            "💾 /export <jsonl/csv> - выгрузить расписание и настройки в файл\n"
+            "📥 /import - загрузить расписание из файла (подпись к файлу или ответ на файл, для администраторов)\n"
             "🔄 /restart - перезапустить бота\n\n"
             "📤 Как начать?\n"
             "Просто перешли мне сообщение, и я буду публиковать его каждый день в указанное время.\n\n"
@@ -411,7 +1081,7 @@ def button_handler(update: Update, context: CallbackContext):
     elif query.data == 'set_timezone':
         query.edit_message_text(text="🌍 Введите временную зону в формате /set_timezone Asia/Bishkek")
     elif query.data == 'set_mode':
-        query.edit_message_text(text="📤 Выберите режим отправки: /set_mode forward или /set_mode copy")
+        query.edit_message_text(text="📤 Выберите режим отправки: /set_mode forward, /set_mode copy или /set_mode snapshot")
     elif query.data == 'info':
         # Вызов функции info
         info(update, context)
@@ -436,6 +1106,9 @@ def restart(update: Update, context: CallbackContext):
 
         logger.info("Перезапуск бота...")
 
+        # Сохраняем пересланные сообщения, ожидающие записи
+        flush_all_ingest_buffers()
+
         # Перезапуск бота
         os.execl(sys.executable, sys.executable, *sys.argv)
 
@@ -477,7 +1150,7 @@ def set_time(update: Update, context: CallbackContext):
         set_publish_times(chat_id, times_str)
         update.message.reply_text(f"Время публикации изменено: {times_str}.")
         logger.info(f"Время публикации изменено для чата {chat_id}: {times_str}.")
-    except sqlite3.Error as e:
+    except StorageError as e:
         logger.error(f"Ошибка базы данных при установке времени публикации: {e}")
         update.message.reply_text("Произошла ошибка при изменении времени. Пожалуйста, попробуйте позже.")
     except Exception as e:
@@ -555,6 +1228,7 @@ def set_target(update: Update, context: CallbackContext):
                 chat = bot.get_chat(target_chat)
                 target_chat_id = chat.id
                 target_chat_username = target_chat
+                target_chat_title = chat.title
             except BadRequest as e:
                 update.message.reply_text(f"Не удалось найти канал {target_chat}. Убедитесь, что бот добавлен в канал.")
                 logger.error(f"Ошибка при получении информации о канале {target_chat}: {e}")
@@ -568,7 +1242,14 @@ def set_target(update: Update, context: CallbackContext):
                 logger.warning(f"Неверный формат ID канала: {target_chat}")
                 return
 
-        set_target_chat(chat_id, target_chat_id, target_chat_username)
+            # Название канала сохраняется, чтобы /info не запрашивал его при каждом вызове
+            target_chat_title = None
+            try:
+                target_chat_title = bot.get_chat(target_chat_id).title
+            except (BadRequest, TelegramError) as e:
+                logger.warning(f"Не удалось получить информацию о канале {target_chat_id}: {e}")
+
+        set_target_chat(chat_id, target_chat_id, target_chat_username, target_chat_title)
         update.message.reply_text(f"Целевой канал установлен: {target_chat}.")
         logger.info(f"Целевой канал установлен для чата {chat_id}: {target_chat_id} ({target_chat_username}).")
     except Exception as e:
@@ -576,6 +1257,7 @@ def set_target(update: Update, context: CallbackContext):
         update.message.reply_text("Произошла ошибка при установке целевого канала.")
 
 # Команда /info - показывает текущие настройки
+@profiled
 def info(update: Update, context: CallbackContext):
     try:
         if update.callback_query:
@@ -587,21 +1269,22 @@ def info(update: Update, context: CallbackContext):
             chat_id = update.message.chat_id
             message = update.message
 
-        # Получаем текущее время и часовой пояс
+        # Получаем текущее время
         current_time = get_current_time().strftime('%H:%M')  # Текущее время в формате HH:MM
-        current_timezone = get_publish_settings(chat_id)[2]  # Получаем текущий часовой пояс
 
-        # Получаем настройки
-        times, days_offset, timezone = get_publish_settings(chat_id)
-        target_chat_id, target_chat_username = get_target_chat(chat_id)
-        send_mode = get_send_mode(chat_id)
+        # Получаем настройки и сводку одним запросом
+        summary = get_chat_summary(chat_id)
+        times, days_offset, timezone = summary['times'], summary['days_offset'], summary['timezone']
+        target_chat_id, target_chat_username = summary['target_chat_id'], summary['target_chat_username']
+        send_mode = summary['send_mode']
 
-        # Получаем название канала, если возможно
-        target_chat_name = None
-        if target_chat_id:
+        # Название канала берется из сохраненного значения и запрашивается только один раз
+        target_chat_name = summary['target_chat_title']
+        if target_chat_id and not target_chat_name:
             try:
                 chat_info = context.bot.get_chat(target_chat_id)
                 target_chat_name = chat_info.title  # Название канала
+                set_target_chat_title(chat_id, target_chat_name)
             except (BadRequest, TelegramError) as e:
                 logger.warning(f"Не удалось получить информацию о канале {target_chat_id}: {e}")
 
@@ -614,31 +1297,25 @@ def info(update: Update, context: CallbackContext):
 
         # Формируем сообщение с текущим временем и часовым поясом
         response = (
-            f"📋 *Текущие настройки* (🕒 Текущее время: {current_time}, 🌍 Часовой пояс: {current_timezone}):\n\n"
+            f"📋 *Текущие настройки* (🕒 Текущее время: {current_time}, 🌍 Часовой пояс: {timezone}):\n\n"
             f"🕒 *Время публикации:* {', '.join(times) if times else 'не установлено'}\n"
             f"📅 *Количество дней:* {days_offset}\n"
             f"📌 *Целевой канал:* {target_chat_info if target_chat_id else 'не установлен'}\n"
             f"🌍 *Временная зона:* {timezone}\n"
             f"📤 *Режим отправки:* {send_mode}\n"
+            f"↔️ *Разнесение отправок:* {'±' + str(summary['spread_minutes']) + ' мин.' if summary['spread_minutes'] else 'выключено'}\n"
+            f"📊 *Репосты:* запланировано {summary['pending_count']}, опубликовано {summary['published_count']}\n"
         )
+        if summary['last_delivery_at']:
+            response += f"✅ *Последняя публикация:* {summary['last_delivery_at']}\n"
+        if summary['last_error']:
+            response += f"⚠️ *Последняя ошибка:* {summary['last_error']}\n"
 
-        # Получаем ближайшие репосты
-        with get_db_connection() as conn:
-            cursor = conn.cursor()
-            cursor.execute('''
-                SELECT publish_date 
-                FROM reposts 
-                WHERE chat_id = ? AND is_published = 0
-                ORDER BY publish_date
-                LIMIT 3
-            ''', (chat_id,))
-            upcoming_reposts = cursor.fetchall()
-
-        if upcoming_reposts:
+        # Ближайшие репосты из сводки
+        if summary['next_due']:
             response += "\n📅 *Ближайшие репосты:*\n"
             now = get_current_time()  # Текущее время
-            for repost in upcoming_reposts:
-                publish_date_str = repost[0]
+            for publish_date_str in summary['next_due']:
                 publish_date = parse_time(publish_date_str)  # Преобразуем строку в datetime
 
                 # Рассчитываем разницу во времени
@@ -680,19 +1357,87 @@ def clear_all_reposts(update: Update, context: CallbackContext):
     try:
         chat_id = update.message.chat_id
         logger.info(f"Пользователь {update.message.from_user.id} вызвал команду /clear_all для чата {chat_id}.")
-        with get_db_connection() as conn:
-            cursor = conn.cursor()
-            cursor.execute('DELETE FROM reposts WHERE chat_id = ?', (chat_id,))
-            conn.commit()
-            logger.info(f"Удалены все репосты для чата {chat_id}. Удалено {cursor.rowcount} записей.")
-            update.message.reply_text("Все репосты (отправленные и запланированные) удалены.")
-    except sqlite3.Error as e:
+        deleted_count = storage.clear_reposts(chat_id)
+        logger.info(f"Удалены все репосты для чата {chat_id}. Удалено {deleted_count} записей.")
+        update.message.reply_text("Все репосты (отправленные и запланированные) удалены.")
+    except StorageError as e:
         logger.error(f"Ошибка при удалении всех репостов: {e}")
         update.message.reply_text("Произошла ошибка при удалении всех репостов.")
     except Exception as e:
         logger.error(f"Ошибка при выполнении команды /clear_all: {e}")
         update.message.reply_text("Произошла ошибка при удалении всех репостов.")
 
+# Строки списка репостов чата (первые limit по дате публикации): сначала запланированные, затем опубликованные.
+# Каждая секция - отдельный проход по курсору, поэтому в памяти находится только текущая порция строк
+def render_repost_list(chat_id, limit, target_chat_info):
+    yield "📅 *Запланированные и опубликованные репосты:*\n\n"
+    yield f"📌 *Целевой канал:* {target_chat_info}\n\n"
+    now = get_current_time()
+    # Даты в формате '%Y-%m-%d %H:%M' сравниваются как строки, datetime создается только для ближайших суток
+    soon_until = (now + timedelta(days=1)).strftime('%Y-%m-%d %H:%M')
+
+    # Секция "Запланированные"
+    index = 0
+    for _, _, message_id, _, publish_date, is_published, dispatch_date in reader.iter_reposts(chat_id, limit):
+        if is_published:
+            continue
+        index += 1
+        if index == 1:
+            yield "📅 *Запланированные репосты:*\n"
+            yield "№ | ID сообщения | Дата публикации | Статус\n"
+            yield "-" * 50 + "\n"
+        # Определяем статус
+        if publish_date <= soon_until:
+            time_diff = (parse_time(publish_date) - now).total_seconds()  # Разница в секундах
+            # Преобразуем разницу в часы и минуты
+            hours = int(time_diff // 3600)
+            minutes = int((time_diff % 3600) // 60)
+            status = f"🟢 Скоро (через {hours}ч{minutes}м)"
+        else:
+            status = "🟡 Ожидает"
+
+        # Если отправка смещена для распределения нагрузки, показываем фактическую минуту
+        if dispatch_date and dispatch_date != publish_date:
+            status += f" (отправка {dispatch_date[11:]})"
+
+        yield f"{index} | {message_id} | *{publish_date}* | {status}\n"
+    if index:
+        yield "\n"
+
+    # Секция "Опубликованные"
+    published = 0
+    for _, _, message_id, _, publish_date, is_published, _ in reader.iter_reposts(chat_id, limit):
+        if not is_published:
+            continue
+        published += 1
+        if published == 1:
+            yield "✅ *Опубликованные репосты:*\n"
+            yield "ID сообщения | Дата публикации | Статус\n"  # Добавляем колонку "Статус"
+            yield "-" * 50 + "\n"
+        yield f"{message_id} | *{publish_date}* | 🔵 Опубликован\n"  # Добавляем статус
+    if published:
+        yield "\n"
+
+    # Если нет репостов
+    if not index and not published:
+        yield "📭 Нет запланированных или опубликованных репостов.\n"
+
+# Отправка строк сообщениями не длиннее max_length (лимит Telegram): сообщение уходит, как только
+# следующая строка в него не помещается
+def reply_lines(message, lines, parse_mode=None, max_length=4096):
+    chunk = ""
+    for line in lines:
+        if len(chunk) + len(line) > max_length and chunk:
+            message.reply_text(chunk, parse_mode=parse_mode)
+            chunk = ""
+        chunk += line
+        while len(chunk) > max_length:
+            message.reply_text(chunk[:max_length], parse_mode=parse_mode)
+            chunk = chunk[max_length:]
+    if chunk:
+        message.reply_text(chunk, parse_mode=parse_mode)
+
+@profiled
 def list_scheduled_posts(update: Update, context: CallbackContext):
     try:
         chat_id = update.message.chat_id
@@ -703,103 +1448,34 @@ def list_scheduled_posts(update: Update, context: CallbackContext):
         if args and args[0].isdigit():
             limit = int(args[0])
 
-        with get_db_connection() as conn:
-            cursor = conn.cursor()
-            # Получаем репосты для данного чата
-            query = '''
-                SELECT id, from_chat_id, message_id, publish_date, is_published 
-                FROM reposts 
-                WHERE chat_id = ?
-                ORDER BY publish_date
-            '''
-            if limit is not None:
-                query += f' LIMIT {limit}'  # Добавляем ограничение, если указано
-
-            cursor.execute(query, (chat_id,))
-            posts = cursor.fetchall()
-
-            if not posts:
-                update.message.reply_text("Нет репостов.")
-                logger.info(f"Для чата {chat_id} нет репостов.")
-                return
+        # Список строится потоково: строки читаются из базы порциями и отправляются по мере накопления сообщения
+        if next(reader.iter_reposts(chat_id, 1), None) is None:
+            update.message.reply_text("Нет репостов.")
+            logger.info(f"Для чата {chat_id} нет репостов.")
+            return
 
-            # Получаем информацию о целевом канале
-            target_chat_id, target_chat_username = get_target_chat(chat_id)
-            target_chat_name = None
-            if target_chat_id:
-                try:
-                    chat_info = context.bot.get_chat(target_chat_id)
-                    target_chat_name = chat_info.title  # Название канала
-                except (BadRequest, TelegramError) as e:
-                    logger.warning(f"Не удалось получить информацию о канале {target_chat_id}: {e}")
-
-            # Формируем строку с целевым каналом
-            target_chat_info = f"{target_chat_id}"  # ID канала
-            if target_chat_name:
-                target_chat_info += f" ({target_chat_name})"  # Добавляем название канала, если доступно
-            elif target_chat_username:
-                target_chat_info += f" (@{target_chat_username})"  # Добавляем username, если доступно
-
-            # Разделяем репосты на запланированные и опубликованные
-            scheduled_posts = []
-            published_posts = []
-            now = get_current_time()
-
-            for post in posts:
-                repost_id, from_chat_id, message_id, publish_date, is_published = post
-                publish_date_obj = parse_time(publish_date)  # Преобразуем строку в datetime
-
-                if is_published:
-                    published_posts.append((repost_id, from_chat_id, message_id, publish_date_obj))
-                else:
-                    scheduled_posts.append((repost_id, from_chat_id, message_id, publish_date_obj))
-
-            # Формируем таблицу с репостами
-            table = "📅 *Запланированные и опубликованные репосты:*\n\n"
-            table += f"📌 *Целевой канал:* {target_chat_info if target_chat_id else 'не установлен'}\n\n"
-
-            # Секция "Запланированные"
-            if scheduled_posts:
-                table += "📅 *Запланированные репосты:*\n"
-                table += "№ | ID сообщения | Дата публикации | Статус\n"
-                table += "-" * 50 + "\n"
-                for index, post in enumerate(scheduled_posts, start=1):
-                    repost_id, from_chat_id, message_id, publish_date = post
-                    time_diff = (publish_date - now).total_seconds()  # Разница в секундах
-
-                    # Определяем статус
-                    if time_diff <= 86400:  # 24 часа в секундах
-                        # Преобразуем разницу в часы и минуты
-                        hours = int(time_diff // 3600)
-                        minutes = int((time_diff % 3600) // 60)
-                        status = f"🟢 Скоро (через {hours}ч{minutes}м)"
-                    else:
-                        status = "🟡 Ожидает"
-
-                    table += f"{index} | {message_id} | *{publish_date.strftime('%Y-%m-%d %H:%M')}* | {status}\n"
-                table += "\n"
-
-            # Секция "Опубликованные"
-            if published_posts:
-                table += "✅ *Опубликованные репосты:*\n"
-                table += "ID сообщения | Дата публикации | Статус\n"  # Добавляем колонку "Статус"
-                table += "-" * 50 + "\n"
-                for post in published_posts:
-                    repost_id, from_chat_id, message_id, publish_date = post
-                    table += f"{message_id} | *{publish_date.strftime('%Y-%m-%d %H:%M')}* | 🔵 Опубликован\n"  # Добавляем статус
-                table += "\n"
-
-            # Если нет репостов
-            if not scheduled_posts and not published_posts:
-                table += "📭 Нет запланированных или опубликованных репостов.\n"
-
-            # Отправляем таблицу частями, если она слишком длинная
-            max_length = 4096  # Максимальная длина сообщения в Telegram
-            for i in range(0, len(table), max_length):
-                update.message.reply_text(table[i:i + max_length], parse_mode="Markdown")
+        # Получаем информацию о целевом канале
+        target_chat_id, target_chat_username = get_target_chat(chat_id)
+        target_chat_name = None
+        if target_chat_id:
+            try:
+                chat_info = context.bot.get_chat(target_chat_id)
+                target_chat_name = chat_info.title  # Название канала
+            except (BadRequest, TelegramError) as e:
+                logger.warning(f"Не удалось получить информацию о канале {target_chat_id}: {e}")
 
-            logger.info(f"Пользователь запросил список репостов для чата {chat_id}.")
-    except sqlite3.Error as e:
+        # Формируем строку с целевым каналом
+        target_chat_info = f"{target_chat_id}"  # ID канала
+        if target_chat_name:
+            target_chat_info += f" ({target_chat_name})"  # Добавляем название канала, если доступно
+        elif target_chat_username:
+            target_chat_info += f" (@{target_chat_username})"  # Добавляем username, если доступно
+
+        lines = render_repost_list(chat_id, limit, target_chat_info if target_chat_id else 'не установлен')
+        reply_lines(update.message, lines, parse_mode="Markdown")
+
+        logger.info(f"Пользователь запросил список репостов для чата {chat_id}.")
+    except StorageError as e:
         logger.error(f"Ошибка базы данных при выполнении команды /list: {e}")
         update.message.reply_text("Произошла ошибка при подключении к базе данных.")
     except Exception as e:
@@ -825,17 +1501,12 @@ def set_timezone(update: Update, context: CallbackContext):
             return
 
         chat_id = update.message.chat_id
-        with get_db_connection() as conn:
-            cursor = conn.cursor()
-            cursor.execute('''UPDATE settings SET timezone = ? WHERE chat_id = ?''', (timezone, chat_id))
-            if cursor.rowcount == 0:
-                cursor.execute('''INSERT INTO settings (chat_id, timezone) VALUES (?, ?)''', (chat_id, timezone))
-            conn.commit()
+        set_chat_timezone(chat_id, timezone)
         global current_timezone
         current_timezone = pytz.timezone(timezone)
         update.message.reply_text(f"Временная зона изменена: {timezone}.")
         logger.info(f"Временная зона изменена для чата {chat_id}: {timezone}.")
-    except sqlite3.Error as e:
+    except StorageError as e:
         logger.error(f"Ошибка базы данных при установке временной зоны: {e}")
         update.message.reply_text("Произошла ошибка при изменении временной зоны.")
     except Exception as e:
@@ -847,8 +1518,8 @@ def set_mode(update: Update, context: CallbackContext):
     try:
         args = context.args
         logger.info(f"Пользователь {update.message.from_user.id} вызвал команду /set_mode с аргументами: {args}")
-        if len(args) != 1 or args[0].lower() not in ["forward", "copy"]:
-            update.message.reply_text("Используй команду в формате: /set_mode <forward/copy>")
+        if len(args) != 1 or args[0].lower() not in SEND_MODES:
+            update.message.reply_text("Используй команду в формате: /set_mode <forward/copy/snapshot>")
             logger.warning(f"Неверные аргументы в команде /set_mode: {args}")
             return
 
@@ -861,6 +1532,27 @@ def set_mode(update: Update, context: CallbackContext):
         logger.error(f"Ошибка при выполнении команды /set_mode: {e}")
         update.message.reply_text("Произошла ошибка при изменении режима отправки.")
 
+# Команда /set_spread - включает разнесение отправок на ±N минут для новых репостов
+def set_spread(update: Update, context: CallbackContext):
+    try:
+        args = context.args
+        logger.info(f"Пользователь {update.message.from_user.id} вызвал команду /set_spread с аргументами: {args}")
+        if len(args) != 1 or not args[0].isdigit() or int(args[0]) > SPREAD_MAX_MINUTES:
+            update.message.reply_text(f"Используй команду в формате: /set_spread <минуты от 0 до {SPREAD_MAX_MINUTES}>")
+            logger.warning(f"Неверные аргументы в команде /set_spread: {args}")
+            return
+
+        spread_minutes = int(args[0])
+        chat_id = update.message.chat_id
+        set_spread_minutes(chat_id, spread_minutes)
+        if spread_minutes:
+            update.message.reply_text(f"Новые репосты будут разнесены на ±{spread_minutes} мин. от времени публикации.")
+        else:
+            update.message.reply_text("Разнесение отправок выключено.")
+    except Exception as e:
+        logger.error(f"Ошибка при выполнении команды /set_spread: {e}")
+        update.message.reply_text("Произошла ошибка при изменении разнесения отправок.")
+
 # Проверка корректности времени
 def is_valid_time(time_str):
     try:
@@ -871,41 +1563,26 @@ def is_valid_time(time_str):
 
 def get_active_chats():
     try:
-        with get_db_connection() as conn:
-            cursor = conn.cursor()
-            cursor.execute('SELECT DISTINCT chat_id FROM reposts')
-            chat_ids = [row[0] for row in cursor.fetchall()]
-            return chat_ids
-    except sqlite3.Error as e:
+        return storage.get_active_chats()
+    except StorageError as e:
         logger.error(f"Ошибка при получении активных чатов: {e}")
         return []
 
 # Обработчик пересланных сообщений
+@profiled
 def handle_forwarded_message(update: Update, context: CallbackContext):
     try:
         if update.message.forward_from_chat:
             from_chat_id = update.message.forward_from_chat.id
             message_id = update.message.forward_from_message_id
-            chat_id = update.message.chat_id
-            times, days_offset, _ = get_publish_settings(chat_id)
-
             logger.info(f"Пользователь {update.message.from_user.id} переслал сообщение {message_id} из чата {from_chat_id}.")
 
-            if not times or days_offset is None:
-                update.message.reply_text(
-                    "Настройки времени публикации или количества дней не установлены. "
-                    "Используйте команды /set_time и /day для настройки."
-                )
-                logger.warning(f"Настройки времени публикации или количества дней не установлены для чата {chat_id}.")
-                return
-
-            add_repost_to_db(chat_id, from_chat_id, message_id, times, days_offset)
-            update.message.reply_text(f"Сообщение добавлено в расписание для публикации в {', '.join(times)} на {days_offset} дней.")
-            logger.info(f"Сообщение {message_id} из чата {from_chat_id} добавлено в расписание для чата {chat_id}.")
+            # Сообщения, пересланные подряд, сохраняются и подтверждаются одной пачкой
+            buffer_forwarded_message(update.message, from_chat_id, message_id)
         else:
             update.message.reply_text("Перешлите сообщение из другого чата.")
             logger.warning(f"Пользователь {update.message.from_user.id} не переслал сообщение из другого чата.")
-    except sqlite3.Error as e:
+    except StorageError as e:
         logger.error(f"Ошибка базы данных при обработке пересланного сообщения: {e}")
         update.message.reply_text("Произошла ошибка при обработке сообщения.")
     except Exception as e:
@@ -918,60 +1595,476 @@ def clear_sent_reposts(update: Update, context: CallbackContext):
     try:
         chat_id = update.message.chat_id
         logger.info(f"Пользователь {update.message.from_user.id} вызвал команду /clear_sent для чата {chat_id}.")
-        with get_db_connection() as conn:
-            cursor = conn.cursor()
-            cursor.execute('DELETE FROM reposts WHERE chat_id = ? AND is_published = 1', (chat_id,))
-            conn.commit()
-            logger.info(f"Удалены отправленные репосты для чата {chat_id}. Удалено {cursor.rowcount} записей.")
-            update.message.reply_text("Все отправленные репосты удалены.")
-    except sqlite3.Error as e:
+        deleted_count = storage.clear_reposts(chat_id, published_only=True)
+        logger.info(f"Удалены отправленные репосты для чата {chat_id}. Удалено {deleted_count} записей.")
+        update.message.reply_text("Все отправленные репосты удалены.")
+    except StorageError as e:
         logger.error(f"Ошибка при удалении отправленных репостов: {e}")
         update.message.reply_text("Произошла ошибка при удалении отправленных репостов.")
     except Exception as e:
         logger.error(f"Ошибка при выполнении команды /clear_sent: {e}")
         update.message.reply_text("Произошла ошибка при удалении отправленных репостов.")
 
+# Поля документа экспорта/импорта (колонки CSV и ключи JSONL)
+EXPORT_FIELDS = ['kind', 'from_chat_id', 'message_id', 'publish_time', 'publish_date', 'is_published', 'dispatch_date',
+                 'time1', 'days_offset', 'timezone', 'send_mode', 'spread_minutes', 'target_chat_id', 'target_chat_username',
+                 'content_hash', 'content']
+EXPORT_FORMATS = ('jsonl', 'csv')
+# Количество строк, вставляемых в одной транзакции
+IMPORT_CHUNK_SIZE = 1000
+
+# Определение формата документа по имени файла
+def detect_export_format(filename, default='jsonl'):
+    if filename:
+        extension = os.path.splitext(filename)[1].lower().lstrip('.')
+        if extension in EXPORT_FORMATS:
+            return extension
+    return default
+
+# Потоковое чтение расписания и настроек чата в виде записей экспорта
+def iter_export_records(chat_id):
+    settings = reader.get_settings(chat_id)
+    if settings:
+        yield dict(settings, kind='settings')
+
+    target_chat = reader.get_target(chat_id)
+    if target_chat:
+        yield {'kind': 'target', 'target_chat_id': target_chat['target_chat_id'],
+               'target_chat_username': target_chat['target_chat_username']}
+
+    # Снимки содержимого (режим snapshot): без них после переноса чата публикации снова зависят от источника
+    for from_chat_id, message_id, content_hash, content in reader.iter_contents(chat_id):
+        yield {'kind': 'content', 'from_chat_id': from_chat_id, 'message_id': message_id,
+               'content_hash': content_hash, 'content': content}
+
+    for _, from_chat_id, message_id, publish_time, publish_date, is_published, dispatch_date in reader.iter_reposts(chat_id):
+        yield {'kind': 'repost', 'from_chat_id': from_chat_id, 'message_id': message_id, 'publish_time': publish_time,
+               'publish_date': publish_date, 'is_published': is_published, 'dispatch_date': dispatch_date}
+
+# Экспорт расписания и настроек чата в текстовый поток (CSV или JSONL)
+def export_chat(chat_id, out, fmt='jsonl'):
+    if fmt not in EXPORT_FORMATS:
+        raise ValueError(f"Неизвестный формат экспорта: {fmt}")
+
+    writer = None
+    if fmt == 'csv':
+        writer = csv.DictWriter(out, fieldnames=EXPORT_FIELDS, restval='')
+        writer.writeheader()
+
+    exported = 0
+    for record in iter_export_records(chat_id):
+        if writer:
+            writer.writerow(record)
+        else:
+            out.write(json.dumps(record, ensure_ascii=False) + '\n')
+        if record['kind'] == 'repost':
+            exported += 1
+    logger.info(f"Экспортировано {exported} репостов для чата {chat_id} в формате {fmt}.")
+    return exported
+
+# Потоковый разбор документа импорта в записи. Нераспознанная строка JSONL дает None и пропускается при импорте
+def iter_import_records(lines, fmt='jsonl'):
+    if fmt == 'csv':
+        for record in csv.DictReader(lines):
+            yield record
+    elif fmt == 'jsonl':
+        for line_number, line in enumerate(lines, 1):
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                yield json.loads(line)
+            except json.JSONDecodeError as e:
+                logger.warning(f"Строка {line_number} документа импорта не является JSON: {e}")
+                yield None
+    else:
+        raise ValueError(f"Неизвестный формат импорта: {fmt}")
+
+# Пустые колонки CSV считаются отсутствующими значениями
+def _import_value(record, key, cast=str):
+    value = record.get(key)
+    if value is None or value == '':
+        return None
+    return cast(value)
+
+# Преобразование записи импорта в строку таблицы reposts
+def _import_repost_row(chat_id, record):
+    publish_date = datetime.strptime(_import_value(record, 'publish_date'), '%Y-%m-%d %H:%M')
+    publish_time = _import_value(record, 'publish_time') or publish_date.strftime('%H:%M')
+    if not is_valid_time(publish_time):
+        raise ValueError(f"Неверный формат времени: {publish_time}")
+    dispatch_date = _import_value(record, 'dispatch_date')
+    if dispatch_date:
+        dispatch_date = datetime.strptime(dispatch_date, '%Y-%m-%d %H:%M').strftime('%Y-%m-%d %H:%M')
+    return (chat_id, _import_value(record, 'from_chat_id', int), _import_value(record, 'message_id', int),
+            publish_time, publish_date.strftime('%Y-%m-%d %H:%M'), _import_value(record, 'is_published', int) or 0,
+            dispatch_date)
+
+# Проверка записи настроек импорта теми же правилами, что и у команд /set_time, /day, /set_timezone,
+# /set_mode и /set_spread. Возвращает поля для update_settings
+def _import_settings(record):
+    time1 = _import_value(record, 'time1')
+    if time1 is not None:
+        invalid_times = [time_str for time_str in time1.split(", ") if not is_valid_time(time_str)]
+        if invalid_times:
+            raise ValueError(f"неверный формат времени: {', '.join(invalid_times)}")
+    days_offset = _import_value(record, 'days_offset', int)
+    if days_offset is not None and days_offset <= 0:
+        raise ValueError(f"количество дней должно быть положительным: {days_offset}")
+    timezone = _import_value(record, 'timezone')
+    if timezone:
+        pytz.timezone(timezone)
+    send_mode = _import_value(record, 'send_mode')
+    if send_mode is not None and send_mode not in SEND_MODES:
+        raise ValueError(f"неизвестный режим отправки: {send_mode}")
+    spread_minutes = _import_value(record, 'spread_minutes', int)
+    if spread_minutes is not None and not 0 <= spread_minutes <= SPREAD_MAX_MINUTES:
+        raise ValueError(f"разнесение должно быть от 0 до {SPREAD_MAX_MINUTES} минут: {spread_minutes}")
+    return {'time1': time1, 'days_offset': days_offset, 'timezone': timezone, 'send_mode': send_mode,
+            'spread_minutes': spread_minutes}
+
+# Преобразование записи импорта в снимок содержимого для add_contents. Ключ содержимого пересчитывается
+def _import_content_entry(record):
+    from_chat_id = _import_value(record, 'from_chat_id', int)
+    message_id = _import_value(record, 'message_id', int)
+    content = _import_value(record, 'content')
+    if from_chat_id is None or message_id is None or content is None:
+        raise ValueError("не указан from_chat_id, message_id или content")
+    snapshot = json.loads(content)
+    if not isinstance(snapshot, dict) or snapshot.get('type') not in ('text',) + SNAPSHOT_MEDIA_TYPES:
+        raise ValueError("неизвестный тип снимка содержимого")
+    content = json.dumps(snapshot, ensure_ascii=False, sort_keys=True, separators=(',', ':'))
+    return from_chat_id, message_id, hashlib.sha256(content.encode()).hexdigest(), content
+
+# Импорт расписания и настроек в чат порциями по IMPORT_CHUNK_SIZE строк в транзакции
+def import_chat(chat_id, lines, fmt='jsonl'):
+    imported = 0
+    skipped = 0
+    chunk = []
+    contents = []
+
+    def flush():
+        nonlocal imported, skipped
+        added = storage.add_reposts(assign_dispatch_dates(chunk, get_spread_minutes(chat_id)))
+        imported += added
+        skipped += len(chunk) - added
+        chunk.clear()
+
+    def flush_contents():
+        storage.add_contents(contents)
+        contents.clear()
+
+    for record in iter_import_records(lines, fmt):
+        if not isinstance(record, dict):
+            skipped += 1
+            logger.warning(f"Пропущена запись импорта для чата {chat_id}: {record} (ожидается объект)")
+            continue
+        kind = record.get('kind') or 'repost'
+        try:
+            if kind == 'repost':
+                row = _import_repost_row(chat_id, record)
+                if row[1] is None or row[2] is None:
+                    raise ValueError("не указан from_chat_id или message_id")
+                chunk.append(row)
+                if len(chunk) >= IMPORT_CHUNK_SIZE:
+                    flush()
+            elif kind == 'content':
+                contents.append(_import_content_entry(record))
+                if len(contents) >= IMPORT_CHUNK_SIZE:
+                    flush_contents()
+            elif kind == 'settings':
+                storage.update_settings(chat_id, **_import_settings(record))
+            elif kind == 'target':
+                storage.set_target(chat_id, _import_value(record, 'target_chat_id', int),
+                                   _import_value(record, 'target_chat_username'))
+            else:
+                raise ValueError(f"неизвестный тип записи {kind}")
+        except (ValueError, TypeError, pytz.UnknownTimeZoneError) as e:
+            skipped += 1
+            logger.warning(f"Пропущена запись импорта для чата {chat_id}: {record} ({e})")
+    if chunk:
+        flush()
+    if contents:
+        flush_contents()
+
+    logger.info(f"Импорт для чата {chat_id} завершен: добавлено {imported}, пропущено {skipped}.")
+    return imported, skipped
+
+# Команда /export - выгружает расписание и настройки чата документом
+def export_schedule(update: Update, context: CallbackContext):
+    path = None
+    try:
+        args = context.args
+        chat_id = update.message.chat_id
+        logger.info(f"Пользователь {update.message.from_user.id} вызвал команду /export с аргументами: {args}")
+
+        fmt = args[0].lower() if args else 'jsonl'
+        if fmt not in EXPORT_FORMATS:
+            update.message.reply_text("Используй команду в формате: /export <jsonl/csv>")
+            logger.warning(f"Неверный формат в команде /export: {args}")
+            return
+
+        # Документ пишется на диск построчно, чтобы не держать расписание в памяти
+        with tempfile.NamedTemporaryFile('w', suffix=f'.{fmt}', encoding='utf-8', newline='', delete=False) as out:
+            path = out.name
+            exported = export_chat(chat_id, out, fmt)
+
+        with open(path, 'rb') as document:
+            update.message.reply_document(document=document, filename=f'reposts_{chat_id}.{fmt}',
+                                          caption=f"Экспортировано репостов: {exported}.")
+    except StorageError as e:
+        logger.error(f"Ошибка базы данных при выполнении команды /export: {e}")
+        update.message.reply_text("Произошла ошибка при экспорте расписания.")
+    except Exception as e:
+        logger.error(f"Ошибка при выполнении команды /export: {e}")
+        update.message.reply_text("Произошла ошибка при экспорте расписания.")
+    finally:
+        if path and os.path.exists(path):
+            os.remove(path)
+
+# Команда /import - загружает расписание и настройки из документа (в подписи или ответом на документ).
+# Только для администраторов: импорт задает произвольные исходные чаты, доступ к которым не подтвержден пересылкой
+def import_schedule(update: Update, context: CallbackContext):
+    path = None
+    try:
+        chat_id = update.message.chat_id
+        user_id = update.message.from_user.id
+        logger.info(f"Пользователь {user_id} вызвал команду /import для чата {chat_id}.")
+        if not is_admin(user_id):
+            update.message.reply_text("Команда доступна только администраторам.")
+            logger.warning(f"Пользователь {user_id} не является администратором.")
+            return
+
+        document = update.message.document
+        if not document and update.message.reply_to_message:
+            document = update.message.reply_to_message.document
+
+        if not document:
+            update.message.reply_text("Отправьте файл .jsonl или .csv с подписью /import или ответьте /import на такой файл.")
+            logger.warning(f"Команда /import вызвана без документа в чате {chat_id}.")
+            return
+
+        fmt = detect_export_format(document.file_name)
+        with tempfile.NamedTemporaryFile(suffix=f'.{fmt}', delete=False) as tmp:
+            path = tmp.name
+        context.bot.get_file(document.file_id).download(custom_path=path)
+
+        with open(path, encoding='utf-8', newline='') as lines:
+            imported, skipped = import_chat(chat_id, lines, fmt)
+        update.message.reply_text(f"Импорт завершен: добавлено {imported} репостов, пропущено {skipped}.")
+    except (ValueError, csv.Error) as e:
+        logger.warning(f"Неверный формат документа импорта: {e}")
+        update.message.reply_text("Неверный формат файла. Поддерживаются .jsonl и .csv, полученные командой /export.")
+    except StorageError as e:
+        logger.error(f"Ошибка базы данных при выполнении команды /import: {e}")
+        update.message.reply_text("Произошла ошибка при импорте расписания.")
+    except Exception as e:
+        logger.error(f"Ошибка при выполнении команды /import: {e}")
+        update.message.reply_text("Произошла ошибка при импорте расписания.")
+    finally:
+        if path and os.path.exists(path):
+            os.remove(path)
+
+# Проверка прав администратора
+def is_admin(user_id):
+    return user_id in ADMIN_IDS
+
+# Команда /profile - профилирование следующих N запусков публикации или вызовов обработчиков (только для администраторов)
+def profile(update: Update, context: CallbackContext):
+    try:
+        args = context.args
+        user_id = update.message.from_user.id
+        logger.info(f"Пользователь {user_id} вызвал команду /profile с аргументами: {args}")
+        if not is_admin(user_id):
+            update.message.reply_text("Команда доступна только администраторам.")
+            logger.warning(f"Пользователь {user_id} не является администратором.")
+            return
+
+        runs = PROFILE_DEFAULT_RUNS
+        if args:
+            if not args[0].isdigit() or int(args[0]) <= 0:
+                update.message.reply_text("Используй команду в формате: /profile <количество вызовов>")
+                logger.warning(f"Неверные аргументы в команде /profile: {args}")
+                return
+            runs = int(args[0])
+
+        start_profiling(runs, context.bot, update.message.chat_id)
+        update.message.reply_text(f"Профилирование включено для следующих {runs} запусков публикации или вызовов команд.")
+    except Exception as e:
+        logger.error(f"Ошибка при выполнении команды /profile: {e}")
+        update.message.reply_text("Произошла ошибка при включении профилирования.")
+
+# Команда /simulate - прогноз отправок в минуту на N дней, текущий и с разнесением (только для администраторов)
+def simulate(update: Update, context: CallbackContext):
+    try:
+        args = context.args
+        user_id = update.message.from_user.id
+        logger.info(f"Пользователь {user_id} вызвал команду /simulate с аргументами: {args}")
+        if not is_admin(user_id):
+            update.message.reply_text("Команда доступна только администраторам.")
+            logger.warning(f"Пользователь {user_id} не является администратором.")
+            return
+
+        if len(args) > 2 or not all(arg.isdigit() for arg in args) or (args and int(args[0]) <= 0):
+            update.message.reply_text("Используй команду в формате: /simulate <количество_дней> <минуты разнесения>")
+            logger.warning(f"Неверные аргументы в команде /simulate: {args}")
+            return
+        days = int(args[0]) if args else 1
+        spread_minutes = int(args[1]) if len(args) > 1 else 5
+
+        update.message.reply_text(simulate_load(days, spread_minutes))
+    except Exception as e:
+        logger.error(f"Ошибка при выполнении команды /simulate: {e}")
+        update.message.reply_text("Произошла ошибка при расчете нагрузки.")
+
+# Команда /lag - задержка доставки (p50/p95/p99) и доля ошибок по чатам и часам за N дней (только для администраторов)
+def lag(update: Update, context: CallbackContext):
+    try:
+        args = context.args
+        user_id = update.message.from_user.id
+        logger.info(f"Пользователь {user_id} вызвал команду /lag с аргументами: {args}")
+        if not is_admin(user_id):
+            update.message.reply_text("Команда доступна только администраторам.")
+            logger.warning(f"Пользователь {user_id} не является администратором.")
+            return
+
+        if len(args) > 1 or (args and (not args[0].isdigit() or int(args[0]) <= 0)):
+            update.message.reply_text("Используй команду в формате: /lag <количество_дней>")
+            logger.warning(f"Неверные аргументы в команде /lag: {args}")
+            return
+        days = int(args[0]) if args else 7
+
+        report = format_dispatch_status() + "\n\n" + delivery_lag_report(days)
+        for start in range(0, len(report), 4096):
+            update.message.reply_text(report[start:start + 4096])
+    except Exception as e:
+        logger.error(f"Ошибка при выполнении команды /lag: {e}")
+        update.message.reply_text("Произошла ошибка при построении отчета о задержках.")
+
+# Команда /lanes - глубина очередей и время ожидания в полосах выполнения (только для администраторов)
+def lanes_command(update: Update, context: CallbackContext):
+    try:
+        user_id = update.message.from_user.id
+        logger.info(f"Пользователь {user_id} вызвал команду /lanes")
+        if not is_admin(user_id):
+            update.message.reply_text("Команда доступна только администраторам.")
+            logger.warning(f"Пользователь {user_id} не является администратором.")
+            return
+
+        lines = []
+        for name, stats in lane_stats().items():
+            lines.append(f"{name}: потоков {stats['workers']}, в очереди {stats['queued']} (максимум {stats['max_queued']}), "
+                         f"выполняется {stats['running']}, выполнено {stats['completed']}, "
+                         f"среднее ожидание {stats['avg_wait_ms']:.0f} мс")
+        update.message.reply_text("\n".join(lines))
+    except Exception as e:
+        logger.error(f"Ошибка при выполнении команды /lanes: {e}")
+        update.message.reply_text("Произошла ошибка при получении состояния очередей.")
+
+# Бот с собственным пулом соединений Bot API. Соединения пула переиспользуются (keep-alive),
+# если одновременных запросов не больше pool_size
+def create_bot(pool_size, token=BOT_TOKEN, base_url=BOT_API_URL):
+    request = Request(con_pool_size=pool_size, connect_timeout=BOT_API_CONNECT_TIMEOUT, read_timeout=BOT_API_READ_TIMEOUT)
+    return ExtBot(token, base_url=base_url, request=request)
+
 # Регистрация обработчиков команд
 def run_bot():
     try:
-        updater = Updater(BOT_TOKEN)
+        # Получение обновлений и ответы на команды: по соединению на поток полосы interactive, polling, диспетчер
+        # и цикл публикации. Обработчики выполняются в полосах, собственные потоки Updater не нужны
+        updater = Updater(bot=create_bot(BOT_WORKERS + 4), workers=1)
         dispatcher = updater.dispatcher
+        # Публикация репостов идет через отдельный пул соединений
+        sending_bot = create_bot(BOT_API_SEND_POOL_SIZE)
 
         # Инициализация базы данных
         init_db()
 
-        # Регистрация обработчиков команд
-        dispatcher.add_handler(CommandHandler("start", start))
-        dispatcher.add_handler(CommandHandler("set_time", set_time))
-        dispatcher.add_handler(CommandHandler("get_time", get_time))
-        dispatcher.add_handler(CommandHandler("day", set_days))
-        dispatcher.add_handler(CommandHandler("set_target", set_target))
-        dispatcher.add_handler(CommandHandler("info", info))
-        dispatcher.add_handler(CommandHandler("list", list_scheduled_posts))
-        dispatcher.add_handler(CommandHandler("delete_repost", delete_repost_by_numbers))
-        dispatcher.add_handler(CommandHandler("clear_sent", clear_sent_reposts))  # Регистрация команды /clear_sent
-        dispatcher.add_handler(CommandHandler("clear_all", clear_all_reposts))
-        dispatcher.add_handler(CommandHandler("set_timezone", set_timezone))
-        dispatcher.add_handler(CommandHandler("set_mode", set_mode))
-        dispatcher.add_handler(CommandHandler("restart", restart))
-        dispatcher.add_handler(CallbackQueryHandler(button_handler))
-        dispatcher.add_handler(MessageHandler(Filters.forwarded, handle_forwarded_message))
-
-        # Запуск планировщика
-        scheduler = BackgroundScheduler(timezone=current_timezone)
-        scheduler.add_job(publish_repost, 'interval', minutes=1, args=[updater.bot])
-        scheduler.start()
-        logger.info("Планировщик запущен.")
+        # Регистрация обработчиков команд. Диспетчер только ставит обновление в очередь полосы interactive
+        dispatcher.add_handler(CommandHandler("start", in_lane('interactive', start)))
+        dispatcher.add_handler(CommandHandler("set_time", in_lane('interactive', set_time)))
+        dispatcher.add_handler(CommandHandler("get_time", in_lane('interactive', get_time)))
+        dispatcher.add_handler(CommandHandler("day", in_lane('interactive', set_days)))
+        dispatcher.add_handler(CommandHandler("set_target", in_lane('interactive', set_target)))
+        dispatcher.add_handler(CommandHandler("info", in_lane('interactive', info)))
+        dispatcher.add_handler(CommandHandler("list", in_lane('interactive', list_scheduled_posts)))
+        dispatcher.add_handler(CommandHandler("delete_repost", in_lane('interactive', delete_repost_by_numbers)))
+        dispatcher.add_handler(CommandHandler("clear_sent", in_lane('interactive', clear_sent_reposts)))  # Регистрация команды /clear_sent
+        dispatcher.add_handler(CommandHandler("clear_all", in_lane('interactive', clear_all_reposts)))
+        dispatcher.add_handler(CommandHandler("set_timezone", in_lane('interactive', set_timezone)))
+        dispatcher.add_handler(CommandHandler("set_mode", in_lane('interactive', set_mode)))
+        dispatcher.add_handler(CommandHandler("set_spread", in_lane('interactive', set_spread)))
+        dispatcher.add_handler(CommandHandler("restart", in_lane('interactive', restart)))
+        dispatcher.add_handler(CommandHandler("export", in_lane('interactive', export_schedule)))
+        dispatcher.add_handler(CommandHandler("import", in_lane('interactive', import_schedule)))
+        dispatcher.add_handler(CommandHandler("profile", in_lane('interactive', profile)))
+        dispatcher.add_handler(CommandHandler("simulate", in_lane('interactive', simulate)))
+        dispatcher.add_handler(CommandHandler("lag", in_lane('interactive', lag)))
+        dispatcher.add_handler(CommandHandler("lanes", in_lane('interactive', lanes_command)))
+        dispatcher.add_handler(MessageHandler(Filters.document & Filters.caption_regex(r'^/import'), in_lane('interactive', import_schedule)))
+        dispatcher.add_handler(CallbackQueryHandler(in_lane('interactive', button_handler)))
+        dispatcher.add_handler(MessageHandler(Filters.forwarded, in_lane('interactive', handle_forwarded_message)))
+
+        # Профилирование по сигналу: kill -USR1 <pid>
+        if hasattr(signal, 'SIGUSR1'):
+            signal.signal(signal.SIGUSR1, handle_profile_signal)
+
+        # Запуск цикла публикации
+        dispatch_stop = threading.Event()
+        dispatch_thread = threading.Thread(target=run_dispatch_loop, args=[sending_bot, dispatch_stop],
+                                           name='dispatch', daemon=True)
+        dispatch_thread.start()
 
         # Запуск бота
-        updater.start_polling()
+        updater.start_polling(timeout=BOT_API_POLL_TIMEOUT)
         logger.info("Бот запущен и готов к работе!")
         updater.idle()
+        dispatch_stop.set()
+        dispatch_thread.join()
+        # Таймеры буферов не успеют поставить сохранение в остановленную полосу
+        flush_all_ingest_buffers()
         logger.info("Бот завершил работу.")
     except Exception as e:
         logger.error(f"Ошибка при запуске бота: {e}")
 
+# Консольные команды: python main.py export|import <chat_id> <файл или -> [--format jsonl/csv]
+# и python main.py simulate [--days N] [--spread M]
+def run_cli(argv):
+    parser = argparse.ArgumentParser(prog='main.py', description="Экспорт и импорт расписания репостов, прогноз нагрузки.")
+    commands = parser.add_subparsers(dest='command', required=True)
+    for command in ('export', 'import'):
+        transfer = commands.add_parser(command)
+        transfer.add_argument('chat_id', type=int)
+        transfer.add_argument('path', help="путь к файлу или - для stdout/stdin")
+        transfer.add_argument('--format', choices=EXPORT_FORMATS, dest='fmt')
+    simulation = commands.add_parser('simulate')
+    simulation.add_argument('--days', type=int, default=1)
+    simulation.add_argument('--spread', type=int, default=5, help="окно разнесения в минутах")
+    args = parser.parse_args(argv)
+
+    init_db()
+    if args.command == 'simulate':
+        sys.stdout.write(simulate_load(args.days, args.spread))
+        return 0
+
+    fmt = args.fmt or detect_export_format(args.path)
+    if args.command == 'export':
+        if args.path == '-':
+            export_chat(args.chat_id, sys.stdout, fmt)
+        else:
+            with open(args.path, 'w', encoding='utf-8', newline='') as out:
+                export_chat(args.chat_id, out, fmt)
+    else:
+        if args.path == '-':
+            import_chat(args.chat_id, sys.stdin, fmt)
+        else:
+            with open(args.path, encoding='utf-8', newline='') as lines:
+                import_chat(args.chat_id, lines, fmt)
+    return 0
+
 if __name__ == '__main__':
+    if len(sys.argv) > 1 and sys.argv[1] in ('export', 'import', 'simulate'):
+        sys.exit(run_cli(sys.argv[1:]))
     try:
         run_bot()
     except Exception as e:
@@ -0,0 +1,1295 @@
+# storage.py
+# Хранилище репостов, настроек и целевых каналов с взаимозаменяемыми движками:
+# SQLite (по умолчанию), в памяти (для бенчмарков) и PostgreSQL.
+
+import logging
+import sqlite3
+import threading
+import heapq
+from collections import defaultdict
+from contextlib import contextmanager
+from pathlib import Path
+
+try:
+    import psycopg2
+    import psycopg2.extras
+    import psycopg2.pool
+except ImportError:  # PostgreSQL нужен только при STORAGE_BACKEND = 'postgres'
+    psycopg2 = None
+
+logger = logging.getLogger(__name__)
+
+# Количество строк, читаемых из курсора за один раз при потоковом обходе
+FETCH_CHUNK_SIZE = 1000
+# Сколько секунд репост, взятый в работу одним экземпляром бота, недоступен для других (PostgreSQL)
+CLAIM_LEASE_SECONDS = 600
+# Сколько секунд ждать свободного соединения из пула PostgreSQL, прежде чем вернуть StorageError
+POOL_WAIT_SECONDS = 30
+
+# Значения по умолчанию для новой строки настроек
+DEFAULT_SETTINGS = {'time1': None, 'days_offset': 10, 'timezone': 'Asia/Bishkek', 'send_mode': 'forward', 'spread_minutes': 0}
+SETTINGS_FIELDS = tuple(DEFAULT_SETTINGS)
+TARGET_FIELDS = ('target_chat_id', 'target_chat_username', 'target_chat_title')
+# Столбцы журнала доставок: запланированная минута отправки (dispatch_date) и время фактической отправки, число попыток,
+# метод Bot API, id отправленного сообщения и класс ошибки (None при успехе)
+DELIVERY_LOG_FIELDS = ('repost_id', 'chat_id', 'target_chat_id', 'scheduled_at', 'sent_at', 'attempts', 'method',
+                       'result_message_id', 'error_class')
+
+
+# Ошибка хранилища, общая для всех движков
+class StorageError(Exception):
+    pass
+
+
+# Интерфейс хранилища. Строки репостов передаются кортежами
+# (chat_id, from_chat_id, message_id, publish_time, publish_date, is_published, dispatch_date),
+# а читаются кортежами (id, from_chat_id, message_id, publish_time, publish_date, is_published, dispatch_date).
+# publish_date - выбранное пользователем время (по нему же отсекаются дубликаты),
+# dispatch_date - минута фактической отправки (отличается при разнесении нагрузки).
+class Storage:
+    name = None
+
+    # Создание таблиц и миграции
+    def init(self):
+        raise NotImplementedError
+
+    # Хранилище для команд, которые только читают данные: свои соединения только для чтения,
+    # не ожидающие записи публикатора. По умолчанию - само хранилище
+    def reader(self):
+        return self
+
+    # Настройки чата: словарь с ключами SETTINGS_FIELDS или None
+    def get_settings(self, chat_id):
+        raise NotImplementedError
+
+    # Замена строки настроек новой строкой только со временем публикации (как INSERT OR REPLACE)
+    def replace_publish_times(self, chat_id, times_str):
+        raise NotImplementedError
+
+    # Обновление переданных полей настроек (None пропускаются), строка создается при отсутствии
+    def update_settings(self, chat_id, **fields):
+        raise NotImplementedError
+
+    # Целевой канал: словарь с ключами target_chat_id, target_chat_username, target_chat_title или None
+    def get_target(self, chat_id):
+        raise NotImplementedError
+
+    def set_target(self, chat_id, target_chat_id, target_chat_username, target_chat_title=None):
+        raise NotImplementedError
+
+    def set_target_title(self, chat_id, target_chat_title):
+        raise NotImplementedError
+
+    # Чаты, публикующие в целевой чат target_chat_id
+    def get_target_owners(self, target_chat_id):
+        raise NotImplementedError
+
+    # Добавление репостов одной транзакцией, дубликаты пропускаются. Возвращает число добавленных строк
+    def add_reposts(self, rows):
+        raise NotImplementedError
+
+    # Потоковый обход репостов чата по возрастанию даты публикации
+    def iter_reposts(self, chat_id, limit=None, published=None):
+        raise NotImplementedError
+
+    # Удаление репостов по id. Возвращает число удаленных строк
+    def delete_reposts(self, repost_ids):
+        raise NotImplementedError
+
+    # Удаление всех (или только опубликованных) репостов чата. Возвращает число удаленных строк
+    def clear_reposts(self, chat_id, published_only=False):
+        raise NotImplementedError
+
+    # Захват неопубликованных репостов с минутой отправки dispatch_date в порядке id:
+    # кортежи (id, chat_id, from_chat_id, message_id, publish_time, publish_date, target_chat_id).
+    # after_id и limit - следующая пачка минуты после репоста after_id, не больше limit репостов.
+    # Репосты с отключенным предохранителем цели или источника пропускаются до времени проверки
+    def claim_due(self, dispatch_date, after_id=0, limit=None):
+        raise NotImplementedError
+
+    # Число неопубликованных репостов по минутам отправки в диапазоне [start, end]: {dispatch_date: count}
+    def count_due_by_minute(self, start, end):
+        raise NotImplementedError
+
+    def mark_published(self, repost_id):
+        raise NotImplementedError
+
+    def get_active_chats(self):
+        raise NotImplementedError
+
+    # Сводка по чату одним запросом: settings и target (словари или None), pending_count, published_count,
+    # next_due (до трех ближайших дат), last_delivery_at, last_error
+    def get_chat_summary(self, chat_id):
+        raise NotImplementedError
+
+    # Запись результата последней доставки (error=None - успешная доставка в delivered_at)
+    def record_delivery_result(self, chat_id, delivered_at=None, error=None):
+        raise NotImplementedError
+
+    # Добавление записей в журнал доставок одной транзакцией (кортежи со столбцами DELIVERY_LOG_FIELDS).
+    # Журнал только дополняется
+    def add_delivery_log(self, entries):
+        raise NotImplementedError
+
+    # Потоковый обход журнала доставок с sent_at >= since в порядке записи (кортежи DELIVERY_LOG_FIELDS)
+    def iter_delivery_log(self, since):
+        raise NotImplementedError
+
+    # Предохранители (circuit breaker): kind 'target' - целевой чат ref_id (message_id = 0),
+    # 'source' - исходное сообщение ref_id/message_id. Учет постоянной ошибки: после threshold ошибок подряд
+    # предохранитель отключает цель или источник до probe_at (каждая следующая ошибка переносит probe_at).
+    # Возвращает True, если предохранитель сработал этим вызовом
+    def record_breaker_failure(self, kind, ref_id, message_id, error, threshold, probe_at):
+        raise NotImplementedError
+
+    # Сброс предохранителя после успешной отправки
+    def reset_breaker(self, kind, ref_id, message_id):
+        raise NotImplementedError
+
+    # Все предохранители с ошибками: {(kind, ref_id, message_id): disabled}
+    def get_breakers(self):
+        raise NotImplementedError
+
+    # Последняя полностью обработанная минута цикла публикации ('%Y-%m-%d %H:%M') или None
+    def get_dispatch_cursor(self):
+        raise NotImplementedError
+
+    def set_dispatch_cursor(self, last_minute):
+        raise NotImplementedError
+
+    # Сохранение снимков содержимого исходных сообщений одной транзакцией: кортежи
+    # (from_chat_id, message_id, content_hash, content). Одинаковое содержимое хранится один раз
+    def add_contents(self, entries):
+        raise NotImplementedError
+
+    # Снимок содержимого исходного сообщения (строка content) или None
+    def get_content(self, from_chat_id, message_id):
+        raise NotImplementedError
+
+    # Потоковый обход снимков сообщений, запланированных в чате: (from_chat_id, message_id, content_hash, content)
+    def iter_contents(self, chat_id):
+        raise NotImplementedError
+
+
+# Снимки сообщений, запланированных в чате (поиск репостов по уникальному индексу chat_id, from_chat_id, message_id)
+ITER_CONTENTS_QUERY = '''
+    SELECT message_contents.from_chat_id, message_contents.message_id, contents.content_hash, contents.content
+    FROM message_contents
+    JOIN contents ON contents.content_hash = message_contents.content_hash
+    WHERE EXISTS (SELECT 1 FROM reposts WHERE reposts.chat_id = {param}
+                  AND reposts.from_chat_id = message_contents.from_chat_id
+                  AND reposts.message_id = message_contents.message_id)
+    ORDER BY message_contents.from_chat_id, message_contents.message_id
+'''
+
+# Пересчет трех ближайших публикаций чата (индексный поиск по idx_reposts_chat_pending)
+CHAT_SUMMARY_NEXT_DUE = '''
+    UPDATE chat_summary SET
+        next_due_1 = (SELECT publish_date FROM reposts WHERE chat_id = {chat} AND is_published = 0
+                      ORDER BY publish_date LIMIT 1 OFFSET 0),
+        next_due_2 = (SELECT publish_date FROM reposts WHERE chat_id = {chat} AND is_published = 0
+                      ORDER BY publish_date LIMIT 1 OFFSET 1),
+        next_due_3 = (SELECT publish_date FROM reposts WHERE chat_id = {chat} AND is_published = 0
+                      ORDER BY publish_date LIMIT 1 OFFSET 2)
+    WHERE chat_id = {chat} AND {condition};
+'''
+
+
+# Исключение репостов с отключенной целью или источником, пока не наступило время проверки ({now})
+BREAKER_EXCLUSION = '''
+    AND NOT EXISTS (SELECT 1 FROM breakers
+                    WHERE breakers.kind = 'target' AND breakers.message_id = 0
+                      AND breakers.ref_id = COALESCE(target_chats.target_chat_id, reposts.chat_id)
+                      AND breakers.disabled = 1 AND breakers.next_probe_at > {now})
+    AND NOT EXISTS (SELECT 1 FROM breakers
+                    WHERE breakers.kind = 'source' AND breakers.ref_id = reposts.from_chat_id
+                      AND breakers.message_id = reposts.message_id
+                      AND breakers.disabled = 1 AND breakers.next_probe_at > {now})
+'''
+
+
+# Столбцы сводки по чату: chat_summary, затем settings и target_chats (каждая группа начинается с chat_id)
+SUMMARY_SETTINGS_COLUMNS = ', '.join(f'settings.{field}' for field in ('chat_id',) + SETTINGS_FIELDS)
+SUMMARY_TARGET_COLUMNS = ', '.join(f'target_chats.{field}' for field in ('chat_id',) + TARGET_FIELDS)
+
+
+# Сводка по чату из строки запроса: остаток строки после столбцов chat_summary - settings и target_chats
+def _chat_summary_from_row(row, pending_count, published_count, next_due, last_delivery_at, last_error):
+    settings_row, target_row = row[:len(SETTINGS_FIELDS) + 1], row[len(SETTINGS_FIELDS) + 1:]
+    return {
+        'settings': dict(zip(SETTINGS_FIELDS, settings_row[1:])) if settings_row[0] is not None else None,
+        'target': dict(zip(TARGET_FIELDS, target_row[1:])) if target_row[0] is not None else None,
+        'pending_count': pending_count or 0,
+        'published_count': published_count or 0,
+        'next_due': next_due,
+        'last_delivery_at': last_delivery_at,
+        'last_error': last_error,
+    }
+
+
+# Хранилище в файле SQLite (поведение бота до появления движков)
+class SQLiteStorage(Storage):
+    name = 'sqlite'
+
+    def __init__(self, path='reposts.db', read_only=False):
+        self.path = path
+        self.read_only = read_only
+
+    def reader(self):
+        return SQLiteStorage(self.path, read_only=True)
+
+    # Подключение к базе данных: фиксация при успехе, откат при ошибке, ошибки sqlite3 -> StorageError
+    @contextmanager
+    def connect(self):
+        try:
+            if self.read_only:
+                conn = sqlite3.connect(f'{Path(self.path).resolve().as_uri()}?mode=ro', uri=True, check_same_thread=False)
+            else:
+                conn = sqlite3.connect(self.path, check_same_thread=False)
+            logger.debug("Успешное подключение к базе данных.")
+        except sqlite3.Error as e:
+            logger.error(f"Ошибка при подключении к базе данных: {e}")
+            raise StorageError(str(e)) from e
+        try:
+            yield conn
+            conn.commit()
+        except sqlite3.Error as e:
+            conn.rollback()
+            raise StorageError(str(e)) from e
+        finally:
+            conn.close()
+
+    def init(self):
+        with self.connect() as conn:
+            cursor = conn.cursor()
+            # В режиме WAL чтение не ждет записи
+            cursor.execute('PRAGMA journal_mode=WAL')
+            cursor.execute('''CREATE TABLE IF NOT EXISTS reposts (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                chat_id INTEGER,
+                from_chat_id INTEGER,
+                message_id INTEGER,
+                publish_time TEXT,
+                publish_date TEXT,
+                is_published INTEGER DEFAULT 0,
+                dispatch_date TEXT,
+                UNIQUE(chat_id, from_chat_id, message_id, publish_date)
+            )''')
+            cursor.execute('''CREATE TABLE IF NOT EXISTS settings (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                chat_id INTEGER UNIQUE,
+                time1 TEXT,
+                days_offset INTEGER DEFAULT 10,
+                timezone TEXT DEFAULT 'Asia/Bishkek',
+                send_mode TEXT DEFAULT 'forward',
+                spread_minutes INTEGER DEFAULT 0
+            )''')
+            cursor.execute('''CREATE TABLE IF NOT EXISTS target_chats (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                chat_id INTEGER UNIQUE,
+                target_chat_id INTEGER,
+                target_chat_username TEXT,
+                target_chat_title TEXT
+            )''')
+            cursor.execute('''CREATE TABLE IF NOT EXISTS delivery_log (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                repost_id INTEGER,
+                chat_id INTEGER,
+                target_chat_id INTEGER,
+                scheduled_at TEXT,
+                sent_at TEXT,
+                attempts INTEGER,
+                method TEXT,
+                result_message_id INTEGER,
+                error_class TEXT
+            )''')
+            cursor.execute('CREATE INDEX IF NOT EXISTS idx_delivery_log_sent ON delivery_log (sent_at)')
+            cursor.execute('''CREATE TABLE IF NOT EXISTS breakers (
+                kind TEXT,
+                ref_id INTEGER,
+                message_id INTEGER,
+                failures INTEGER DEFAULT 0,
+                disabled INTEGER DEFAULT 0,
+                next_probe_at TEXT,
+                last_error TEXT,
+                PRIMARY KEY (kind, ref_id, message_id)
+            )''')
+            cursor.execute('''CREATE TABLE IF NOT EXISTS contents (
+                content_hash TEXT PRIMARY KEY,
+                content TEXT
+            )''')
+            cursor.execute('''CREATE TABLE IF NOT EXISTS message_contents (
+                from_chat_id INTEGER,
+                message_id INTEGER,
+                content_hash TEXT,
+                PRIMARY KEY (from_chat_id, message_id)
+            )''')
+            cursor.execute('''CREATE TABLE IF NOT EXISTS dispatch_cursor (
+                id INTEGER PRIMARY KEY CHECK (id = 1),
+                last_minute TEXT
+            )''')
+            conn.commit()
+            logger.info("Таблицы 'reposts', 'settings', 'target_chats' и 'delivery_log' созданы или уже существуют.")
+
+            self._init_chat_summary(cursor)
+            conn.commit()
+
+            # Проверка наличия столбца send_mode в таблице settings
+            self._add_column(cursor, 'settings', 'send_mode', 'TEXT DEFAULT "forward"')
+            # Проверка наличия столбца target_chat_title в таблице target_chats
+            self._add_column(cursor, 'target_chats', 'target_chat_title', 'TEXT')
+            # Проверка наличия столбца spread_minutes в таблице settings
+            self._add_column(cursor, 'settings', 'spread_minutes', 'INTEGER DEFAULT 0')
+            # Минута отправки существующих репостов совпадает с временем публикации
+            if self._add_column(cursor, 'reposts', 'dispatch_date', 'TEXT'):
+                cursor.execute('UPDATE reposts SET dispatch_date = publish_date')
+            cursor.execute('CREATE INDEX IF NOT EXISTS idx_reposts_dispatch ON reposts (is_published, dispatch_date)')
+
+    # Добавление столбца в существующую таблицу, если его нет. Возвращает True, если столбец добавлен
+    def _add_column(self, cursor, table, column, definition):
+        cursor.execute(f"PRAGMA table_info({table})")
+        column_names = [row[1] for row in cursor.fetchall()]
+        if column in column_names:
+            return False
+        cursor.execute(f'ALTER TABLE {table} ADD COLUMN {column} {definition}')
+        logger.info(f"Столбец '{column}' добавлен в таблицу '{table}'.")
+        return True
+
+    # Сводка по чату для /info, поддерживаемая триггерами на таблице reposts
+    def _init_chat_summary(self, cursor):
+        cursor.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'chat_summary'")
+        summary_exists = cursor.fetchone() is not None
+
+        cursor.execute('''CREATE TABLE IF NOT EXISTS chat_summary (
+            chat_id INTEGER PRIMARY KEY,
+            pending_count INTEGER DEFAULT 0,
+            published_count INTEGER DEFAULT 0,
+            next_due_1 TEXT,
+            next_due_2 TEXT,
+            next_due_3 TEXT,
+            last_delivery_at TEXT,
+            last_error TEXT
+        )''')
+        cursor.execute('CREATE INDEX IF NOT EXISTS idx_reposts_chat_pending ON reposts (chat_id, is_published, publish_date)')
+
+        cursor.execute(f'''CREATE TRIGGER IF NOT EXISTS chat_summary_insert AFTER INSERT ON reposts BEGIN
+            INSERT OR IGNORE INTO chat_summary (chat_id) VALUES (NEW.chat_id);
+            UPDATE chat_summary SET pending_count = pending_count + (NEW.is_published = 0),
+                                    published_count = published_count + (NEW.is_published != 0)
+            WHERE chat_id = NEW.chat_id;
+            {CHAT_SUMMARY_NEXT_DUE.format(chat='NEW.chat_id', condition='NEW.is_published = 0 AND (next_due_3 IS NULL OR NEW.publish_date < next_due_3)')}
+        END''')
+        cursor.execute(f'''CREATE TRIGGER IF NOT EXISTS chat_summary_delete AFTER DELETE ON reposts BEGIN
+            UPDATE chat_summary SET pending_count = pending_count - (OLD.is_published = 0),
+                                    published_count = published_count - (OLD.is_published != 0)
+            WHERE chat_id = OLD.chat_id;
+            {CHAT_SUMMARY_NEXT_DUE.format(chat='OLD.chat_id', condition='OLD.is_published = 0 AND (next_due_3 IS NULL OR OLD.publish_date <= next_due_3)')}
+        END''')
+        cursor.execute(f'''CREATE TRIGGER IF NOT EXISTS chat_summary_update AFTER UPDATE OF is_published, publish_date ON reposts
+        WHEN OLD.is_published != NEW.is_published OR OLD.publish_date != NEW.publish_date BEGIN
+            UPDATE chat_summary SET pending_count = pending_count - (OLD.is_published = 0) + (NEW.is_published = 0),
+                                    published_count = published_count - (OLD.is_published != 0) + (NEW.is_published != 0)
+            WHERE chat_id = NEW.chat_id;
+            {CHAT_SUMMARY_NEXT_DUE.format(chat='NEW.chat_id', condition='1')}
+        END''')
+
+        # Для существующей базы сводка заполняется один раз при создании таблицы
+        if not summary_exists:
+            cursor.execute('''INSERT OR REPLACE INTO chat_summary (chat_id, pending_count, published_count)
+                              SELECT chat_id, SUM(is_published = 0), SUM(is_published != 0) FROM reposts GROUP BY chat_id''')
+            cursor.execute(CHAT_SUMMARY_NEXT_DUE.format(chat='chat_summary.chat_id', condition='1'))
+            logger.info(f"Таблица 'chat_summary' создана и заполнена для {cursor.rowcount} чатов.")
+
+    def get_settings(self, chat_id):
+        with self.connect() as conn:
+            cursor = conn.cursor()
+            cursor.execute(f'SELECT {", ".join(SETTINGS_FIELDS)} FROM settings WHERE chat_id = ?', (chat_id,))
+            row = cursor.fetchone()
+        return dict(zip(SETTINGS_FIELDS, row)) if row else None
+
+    def replace_publish_times(self, chat_id, times_str):
+        with self.connect() as conn:
+            conn.execute('INSERT OR REPLACE INTO settings (chat_id, time1) VALUES (?, ?)', (chat_id, times_str))
+
+    def update_settings(self, chat_id, **fields):
+        fields = {key: value for key, value in fields.items() if value is not None}
+        if not fields:
+            return
+        columns = list(fields)
+        values = [fields[column] for column in columns]
+        with self.connect() as conn:
+            cursor = conn.cursor()
+            cursor.execute(f'''UPDATE settings SET {", ".join(f"{column} = ?" for column in columns)} WHERE chat_id = ?''',
+                           values + [chat_id])
+            if cursor.rowcount == 0:
+                cursor.execute(f'''INSERT INTO settings (chat_id, {", ".join(columns)})
+                                   VALUES (?{", ?" * len(columns)})''', [chat_id] + values)
+
+    def get_target(self, chat_id):
+        with self.connect() as conn:
+            cursor = conn.cursor()
+            cursor.execute('''SELECT target_chat_id, target_chat_username, target_chat_title
+                              FROM target_chats WHERE chat_id = ?''', (chat_id,))
+            row = cursor.fetchone()
+        return dict(zip(TARGET_FIELDS, row)) if row else None
+
+    def set_target(self, chat_id, target_chat_id, target_chat_username, target_chat_title=None):
+        with self.connect() as conn:
+            conn.execute('''INSERT OR REPLACE INTO target_chats (chat_id, target_chat_id, target_chat_username, target_chat_title)
+                            VALUES (?, ?, ?, ?)''', (chat_id, target_chat_id, target_chat_username, target_chat_title))
+
+    def set_target_title(self, chat_id, target_chat_title):
+        with self.connect() as conn:
+            conn.execute('UPDATE target_chats SET target_chat_title = ? WHERE chat_id = ?', (target_chat_title, chat_id))
+
+    def get_target_owners(self, target_chat_id):
+        with self.connect() as conn:
+            cursor = conn.cursor()
+            cursor.execute('SELECT chat_id FROM target_chats WHERE target_chat_id = ? ORDER BY chat_id', (target_chat_id,))
+            return [row[0] for row in cursor.fetchall()]
+
+    def add_reposts(self, rows):
+        with self.connect() as conn:
+            cursor = conn.cursor()
+            cursor.executemany('''
+                INSERT OR IGNORE INTO reposts (chat_id, from_chat_id, message_id, publish_time, publish_date, is_published,
+                                               dispatch_date)
+                VALUES (?, ?, ?, ?, ?, ?, ?)
+            ''', rows)
+            return cursor.rowcount
+
+    def iter_reposts(self, chat_id, limit=None, published=None):
+        query = '''
+            SELECT id, from_chat_id, message_id, publish_time, publish_date, is_published, dispatch_date
+            FROM reposts
+            WHERE chat_id = ?
+        '''
+        params = [chat_id]
+        if published is not None:
+            query += ' AND is_published = ?'
+            params.append(1 if published else 0)
+        query += ' ORDER BY publish_date, id'
+        if limit is not None:
+            query += ' LIMIT ?'
+            params.append(limit)
+
+        with self.connect() as conn:
+            cursor = conn.cursor()
+            cursor.execute(query, params)
+            while True:
+                rows = cursor.fetchmany(FETCH_CHUNK_SIZE)
+                if not rows:
+                    break
+                yield from rows
+
+    def delete_reposts(self, repost_ids):
+        with self.connect() as conn:
+            cursor = conn.cursor()
+            cursor.executemany('DELETE FROM reposts WHERE id = ?', [(repost_id,) for repost_id in repost_ids])
+            return cursor.rowcount
+
+    def clear_reposts(self, chat_id, published_only=False):
+        with self.connect() as conn:
+            cursor = conn.cursor()
+            if published_only:
+                cursor.execute('DELETE FROM reposts WHERE chat_id = ? AND is_published = 1', (chat_id,))
+            else:
+                cursor.execute('DELETE FROM reposts WHERE chat_id = ?', (chat_id,))
+            return cursor.rowcount
+
+    def claim_due(self, dispatch_date, after_id=0, limit=None):
+        with self.connect() as conn:
+            cursor = conn.cursor()
+            cursor.execute('''SELECT reposts.id, reposts.chat_id, reposts.from_chat_id, reposts.message_id,
+                                     reposts.publish_time, reposts.publish_date, target_chats.target_chat_id
+                              FROM reposts
+                              LEFT JOIN target_chats ON reposts.chat_id = target_chats.chat_id
+                              WHERE reposts.is_published = 0 AND reposts.dispatch_date = ? AND reposts.id > ?'''
+                           + BREAKER_EXCLUSION.format(now='?') + ' ORDER BY reposts.id LIMIT ?',
+                           (dispatch_date, after_id, dispatch_date, dispatch_date, -1 if limit is None else limit))
+            return cursor.fetchall()
+
+    def count_due_by_minute(self, start, end):
+        with self.connect() as conn:
+            cursor = conn.cursor()
+            cursor.execute('''SELECT dispatch_date, COUNT(*) FROM reposts
+                              WHERE is_published = 0 AND dispatch_date BETWEEN ? AND ?
+                              GROUP BY dispatch_date''', (start, end))
+            return dict(cursor.fetchall())
+
+    def mark_published(self, repost_id):
+        with self.connect() as conn:
+            conn.execute('UPDATE reposts SET is_published = 1 WHERE id = ?', (repost_id,))
+
+    def get_active_chats(self):
+        with self.connect() as conn:
+            cursor = conn.cursor()
+            cursor.execute('SELECT DISTINCT chat_id FROM reposts')
+            return [row[0] for row in cursor.fetchall()]
+
+    def get_chat_summary(self, chat_id):
+        with self.connect() as conn:
+            cursor = conn.cursor()
+            cursor.execute(f'''
+                SELECT chat_summary.pending_count, chat_summary.published_count,
+                       chat_summary.next_due_1, chat_summary.next_due_2, chat_summary.next_due_3,
+                       chat_summary.last_delivery_at, chat_summary.last_error,
+                       {SUMMARY_SETTINGS_COLUMNS}, {SUMMARY_TARGET_COLUMNS}
+                FROM (SELECT ? AS chat_id) AS chat
+                LEFT JOIN settings ON settings.chat_id = chat.chat_id
+                LEFT JOIN target_chats ON target_chats.chat_id = chat.chat_id
+                LEFT JOIN chat_summary ON chat_summary.chat_id = chat.chat_id
+            ''', (chat_id,))
+            row = cursor.fetchone()
+        return _chat_summary_from_row(row[7:], row[0], row[1], [publish_date for publish_date in row[2:5] if publish_date],
+                                      row[5], row[6])
+
+    def record_delivery_result(self, chat_id, delivered_at=None, error=None):
+        with self.connect() as conn:
+            if error is None:
+                conn.execute('UPDATE chat_summary SET last_delivery_at = ?, last_error = NULL WHERE chat_id = ?',
+                             (delivered_at, chat_id))
+            else:
+                conn.execute('UPDATE chat_summary SET last_error = ? WHERE chat_id = ?', (str(error), chat_id))
+
+    def add_delivery_log(self, entries):
+        with self.connect() as conn:
+            conn.executemany(f'''
+                INSERT INTO delivery_log ({', '.join(DELIVERY_LOG_FIELDS)})
+                VALUES ({', '.join('?' for _ in DELIVERY_LOG_FIELDS)})
+            ''', entries)
+
+    def iter_delivery_log(self, since):
+        with self.connect() as conn:
+            cursor = conn.cursor()
+            cursor.execute(f'SELECT {", ".join(DELIVERY_LOG_FIELDS)} FROM delivery_log WHERE sent_at >= ? ORDER BY id',
+                           (since,))
+            while True:
+                rows = cursor.fetchmany(FETCH_CHUNK_SIZE)
+                if not rows:
+                    break
+                yield from rows
+
+    def record_breaker_failure(self, kind, ref_id, message_id, error, threshold, probe_at):
+        with self.connect() as conn:
+            cursor = conn.cursor()
+            cursor.execute('''
+                INSERT INTO breakers (kind, ref_id, message_id, failures, disabled, next_probe_at, last_error)
+                VALUES (?, ?, ?, 1, ? <= 1, ?, ?)
+                ON CONFLICT (kind, ref_id, message_id) DO UPDATE SET
+                    failures = failures + 1,
+                    disabled = failures + 1 >= ?,
+                    next_probe_at = excluded.next_probe_at,
+                    last_error = excluded.last_error
+            ''', (kind, ref_id, message_id, threshold, probe_at, str(error), threshold))
+            cursor.execute('SELECT failures FROM breakers WHERE kind = ? AND ref_id = ? AND message_id = ?',
+                           (kind, ref_id, message_id))
+            return cursor.fetchone()[0] == threshold
+
+    def reset_breaker(self, kind, ref_id, message_id):
+        with self.connect() as conn:
+            conn.execute('DELETE FROM breakers WHERE kind = ? AND ref_id = ? AND message_id = ?', (kind, ref_id, message_id))
+
+    def get_breakers(self):
+        with self.connect() as conn:
+            cursor = conn.cursor()
+            cursor.execute('SELECT kind, ref_id, message_id, disabled FROM breakers')
+            return {(kind, ref_id, message_id): disabled for kind, ref_id, message_id, disabled in cursor.fetchall()}
+
+    def get_dispatch_cursor(self):
+        with self.connect() as conn:
+            cursor = conn.cursor()
+            cursor.execute('SELECT last_minute FROM dispatch_cursor WHERE id = 1')
+            row = cursor.fetchone()
+            return row[0] if row else None
+
+    def set_dispatch_cursor(self, last_minute):
+        with self.connect() as conn:
+            conn.execute('''INSERT INTO dispatch_cursor (id, last_minute) VALUES (1, ?)
+                            ON CONFLICT (id) DO UPDATE SET last_minute = excluded.last_minute''', (last_minute,))
+
+    def add_contents(self, entries):
+        entries = list(entries)
+        with self.connect() as conn:
+            conn.executemany('INSERT OR IGNORE INTO contents (content_hash, content) VALUES (?, ?)',
+                             [(content_hash, content) for _, _, content_hash, content in entries])
+            conn.executemany('''
+                INSERT INTO message_contents (from_chat_id, message_id, content_hash) VALUES (?, ?, ?)
+                ON CONFLICT (from_chat_id, message_id) DO UPDATE SET content_hash = excluded.content_hash
+            ''', [entry[:3] for entry in entries])
+
+    def get_content(self, from_chat_id, message_id):
+        with self.connect() as conn:
+            cursor = conn.cursor()
+            cursor.execute('''SELECT contents.content FROM message_contents
+                              JOIN contents ON contents.content_hash = message_contents.content_hash
+                              WHERE message_contents.from_chat_id = ? AND message_contents.message_id = ?''',
+                           (from_chat_id, message_id))
+            row = cursor.fetchone()
+            return row[0] if row else None
+
+    def iter_contents(self, chat_id):
+        with self.connect() as conn:
+            cursor = conn.cursor()
+            cursor.execute(ITER_CONTENTS_QUERY.format(param='?'), (chat_id,))
+            while True:
+                rows = cursor.fetchmany(FETCH_CHUNK_SIZE)
+                if not rows:
+                    break
+                yield from rows
+
+
+# Хранилище в памяти процесса (для бенчмарков и экспериментов, данные не сохраняются)
+class MemoryStorage(Storage):
+    name = 'memory'
+
+    def __init__(self):
+        self.lock = threading.RLock()
+        self.settings = {}
+        self.targets = {}
+        # id -> [id, chat_id, from_chat_id, message_id, publish_time, publish_date, is_published, dispatch_date]
+        self.reposts = {}
+        self.keys = {}  # (chat_id, from_chat_id, message_id, publish_date) -> id
+        self.by_chat = defaultdict(set)
+        self.by_dispatch = defaultdict(set)
+        self.summary = defaultdict(lambda: {'last_delivery_at': None, 'last_error': None})
+        self.delivery_log = []
+        self.breakers = {}  # (kind, ref_id, message_id) -> {'failures', 'disabled', 'next_probe_at', 'last_error'}
+        self.contents = {}  # content_hash -> content
+        self.message_contents = {}  # (from_chat_id, message_id) -> content_hash
+        self.dispatch_cursor = None
+        self.next_id = 1
+
+    def init(self):
+        logger.info("Используется хранилище в памяти.")
+
+    def get_settings(self, chat_id):
+        with self.lock:
+            settings = self.settings.get(chat_id)
+            return dict(settings) if settings else None
+
+    def replace_publish_times(self, chat_id, times_str):
+        with self.lock:
+            self.settings[chat_id] = dict(DEFAULT_SETTINGS, time1=times_str)
+
+    def update_settings(self, chat_id, **fields):
+        with self.lock:
+            settings = self.settings.setdefault(chat_id, dict(DEFAULT_SETTINGS))
+            settings.update((key, value) for key, value in fields.items() if value is not None)
+
+    def get_target(self, chat_id):
+        with self.lock:
+            target = self.targets.get(chat_id)
+            return dict(target) if target else None
+
+    def set_target(self, chat_id, target_chat_id, target_chat_username, target_chat_title=None):
+        with self.lock:
+            self.targets[chat_id] = {'target_chat_id': target_chat_id, 'target_chat_username': target_chat_username,
+                                     'target_chat_title': target_chat_title}
+
+    def set_target_title(self, chat_id, target_chat_title):
+        with self.lock:
+            if chat_id in self.targets:
+                self.targets[chat_id]['target_chat_title'] = target_chat_title
+
+    def get_target_owners(self, target_chat_id):
+        with self.lock:
+            return sorted(chat_id for chat_id, target in self.targets.items() if target['target_chat_id'] == target_chat_id)
+
+    def add_reposts(self, rows):
+        added = 0
+        with self.lock:
+            for chat_id, from_chat_id, message_id, publish_time, publish_date, is_published, dispatch_date in rows:
+                key = (chat_id, from_chat_id, message_id, publish_date)
+                if key in self.keys:
+                    continue
+                repost_id = self.next_id
+                self.next_id += 1
+                self.reposts[repost_id] = [repost_id, chat_id, from_chat_id, message_id, publish_time, publish_date,
+                                           is_published or 0, dispatch_date]
+                self.keys[key] = repost_id
+                self.by_chat[chat_id].add(repost_id)
+                self.by_dispatch[dispatch_date].add(repost_id)
+                added += 1
+        return added
+
+    def iter_reposts(self, chat_id, limit=None, published=None):
+        with self.lock:
+            rows = [tuple(self.reposts[repost_id][i] for i in (0, 2, 3, 4, 5, 6, 7)) for repost_id in self.by_chat.get(chat_id, ())]
+        if published is not None:
+            rows = [row for row in rows if bool(row[5]) == bool(published)]
+        rows.sort(key=lambda row: (row[4], row[0]))
+        return iter(rows[:limit] if limit is not None else rows)
+
+    def delete_reposts(self, repost_ids):
+        deleted = 0
+        with self.lock:
+            for repost_id in repost_ids:
+                repost = self.reposts.pop(repost_id, None)
+                if repost is None:
+                    continue
+                _, chat_id, from_chat_id, message_id, _, publish_date, _, dispatch_date = repost
+                del self.keys[(chat_id, from_chat_id, message_id, publish_date)]
+                self.by_chat[chat_id].discard(repost_id)
+                self.by_dispatch[dispatch_date].discard(repost_id)
+                deleted += 1
+        return deleted
+
+    def clear_reposts(self, chat_id, published_only=False):
+        with self.lock:
+            repost_ids = [repost_id for repost_id in self.by_chat.get(chat_id, ())
+                          if not published_only or self.reposts[repost_id][6]]
+            return self.delete_reposts(repost_ids)
+
+    def claim_due(self, dispatch_date, after_id=0, limit=None):
+        with self.lock:
+            due = []
+            for repost_id in sorted(self.by_dispatch.get(dispatch_date, ())):
+                if limit is not None and len(due) >= limit:
+                    break
+                repost = self.reposts[repost_id]
+                if repost[6] or repost_id <= after_id:
+                    continue
+                target = self.targets.get(repost[1])
+                target_chat_id = target['target_chat_id'] if target else None
+                if (self._breaker_open(('target', target_chat_id or repost[1], 0), dispatch_date) or
+                        self._breaker_open(('source', repost[2], repost[3]), dispatch_date)):
+                    continue
+                due.append(tuple(repost[:6]) + (target_chat_id,))
+            return due
+
+    def _breaker_open(self, key, now):
+        breaker = self.breakers.get(key)
+        return breaker is not None and breaker['disabled'] and breaker['next_probe_at'] > now
+
+    def count_due_by_minute(self, start, end):
+        with self.lock:
+            load = {}
+            for dispatch_date, repost_ids in self.by_dispatch.items():
+                if start <= dispatch_date <= end:
+                    count = sum(1 for repost_id in repost_ids if not self.reposts[repost_id][6])
+                    if count:
+                        load[dispatch_date] = count
+            return load
+
+    def mark_published(self, repost_id):
+        with self.lock:
+            if repost_id in self.reposts:
+                self.reposts[repost_id][6] = 1
+
+    def get_active_chats(self):
+        with self.lock:
+            return [chat_id for chat_id, repost_ids in self.by_chat.items() if repost_ids]
+
+    def get_chat_summary(self, chat_id):
+        with self.lock:
+            reposts = [self.reposts[repost_id] for repost_id in self.by_chat.get(chat_id, ())]
+            pending = [repost[5] for repost in reposts if not repost[6]]
+            summary = self.summary.get(chat_id) or {'last_delivery_at': None, 'last_error': None}
+            return {
+                'settings': self.get_settings(chat_id),
+                'target': self.get_target(chat_id),
+                'pending_count': len(pending),
+                'published_count': len(reposts) - len(pending),
+                'next_due': heapq.nsmallest(3, pending),
+                'last_delivery_at': summary['last_delivery_at'],
+                'last_error': summary['last_error'],
+            }
+
+    def record_delivery_result(self, chat_id, delivered_at=None, error=None):
+        with self.lock:
+            if error is None:
+                self.summary[chat_id].update(last_delivery_at=delivered_at, last_error=None)
+            else:
+                self.summary[chat_id]['last_error'] = str(error)
+
+    def add_delivery_log(self, entries):
+        with self.lock:
+            self.delivery_log.extend(tuple(entry) for entry in entries)
+
+    def iter_delivery_log(self, since):
+        with self.lock:
+            entries = [entry for entry in self.delivery_log if entry[4] >= since]
+        return iter(entries)
+
+    def record_breaker_failure(self, kind, ref_id, message_id, error, threshold, probe_at):
+        with self.lock:
+            breaker = self.breakers.setdefault((kind, ref_id, message_id), {'failures': 0, 'disabled': 0})
+            breaker['failures'] += 1
+            breaker.update(disabled=int(breaker['failures'] >= threshold), next_probe_at=probe_at, last_error=str(error))
+            return breaker['failures'] == threshold
+
+    def reset_breaker(self, kind, ref_id, message_id):
+        with self.lock:
+            self.breakers.pop((kind, ref_id, message_id), None)
+
+    def get_breakers(self):
+        with self.lock:
+            return {key: breaker['disabled'] for key, breaker in self.breakers.items()}
+
+    def get_dispatch_cursor(self):
+        with self.lock:
+            return self.dispatch_cursor
+
+    def set_dispatch_cursor(self, last_minute):
+        with self.lock:
+            self.dispatch_cursor = last_minute
+
+    def add_contents(self, entries):
+        with self.lock:
+            for from_chat_id, message_id, content_hash, content in entries:
+                self.contents.setdefault(content_hash, content)
+                self.message_contents[(from_chat_id, message_id)] = content_hash
+
+    def get_content(self, from_chat_id, message_id):
+        with self.lock:
+            content_hash = self.message_contents.get((from_chat_id, message_id))
+            return self.contents.get(content_hash)
+
+    def iter_contents(self, chat_id):
+        with self.lock:
+            messages = sorted({tuple(self.reposts[repost_id][2:4]) for repost_id in self.by_chat.get(chat_id, ())})
+            rows = [(from_chat_id, message_id, self.message_contents[(from_chat_id, message_id)],
+                     self.contents[self.message_contents[(from_chat_id, message_id)]])
+                    for from_chat_id, message_id in messages if (from_chat_id, message_id) in self.message_contents]
+        return iter(rows)
+
+
+# Хранилище в PostgreSQL: пул соединений и захват репостов через SELECT ... FOR UPDATE SKIP LOCKED,
+# поэтому несколько экземпляров бота могут работать с одной базой
+class PostgresStorage(Storage):
+    name = 'postgres'
+
+    def __init__(self, dsn, pool_size=10, read_only=False):
+        if psycopg2 is None:
+            raise StorageError("Для хранилища PostgreSQL требуется пакет psycopg2 (pip install psycopg2-binary).")
+        self.dsn = dsn
+        self.pool_size = pool_size
+        # ThreadedConnectionPool не ждет освобождения соединения, а сразу выбрасывает PoolError:
+        # семафор по размеру пула заставляет лишние потоки ждать
+        self.slots = threading.BoundedSemaphore(pool_size)
+        # Соединения только для чтения - отдельный пул с транзакциями READ ONLY
+        options = {'options': '-c default_transaction_read_only=on'} if read_only else {}
+        try:
+            self.pool = psycopg2.pool.ThreadedConnectionPool(1, pool_size, dsn, **options)
+        except psycopg2.Error as e:
+            logger.error(f"Ошибка при подключении к базе данных: {e}")
+            raise StorageError(str(e)) from e
+
+    # Соединение из пула (с ожиданием свободного до POOL_WAIT_SECONDS): фиксация при успехе, откат при ошибке,
+    # ошибки psycopg2 -> StorageError
+    @contextmanager
+    def connect(self):
+        if not self.slots.acquire(timeout=POOL_WAIT_SECONDS):
+            logger.error(f"Нет свободных соединений в пуле PostgreSQL ({self.pool_size}) за {POOL_WAIT_SECONDS} с.")
+            raise StorageError("Нет свободных соединений в пуле PostgreSQL")
+        try:
+            conn = self.pool.getconn()
+        except psycopg2.Error as e:
+            self.slots.release()
+            logger.error(f"Ошибка при подключении к базе данных: {e}")
+            raise StorageError(str(e)) from e
+        try:
+            yield conn
+            conn.commit()
+        except psycopg2.Error as e:
+            conn.rollback()
+            raise StorageError(str(e)) from e
+        except BaseException:
+            conn.rollback()
+            raise
+        finally:
+            self.pool.putconn(conn)
+            self.slots.release()
+
+    def reader(self):
+        return PostgresStorage(self.dsn, self.pool_size, read_only=True)
+
+    def init(self):
+        with self.connect() as conn:
+            cursor = conn.cursor()
+            cursor.execute('''CREATE TABLE IF NOT EXISTS reposts (
+                id BIGSERIAL PRIMARY KEY,
+                chat_id BIGINT,
+                from_chat_id BIGINT,
+                message_id BIGINT,
+                publish_time TEXT,
+                publish_date TEXT,
+                is_published INTEGER DEFAULT 0,
+                dispatch_date TEXT,
+                claimed_until TIMESTAMPTZ,
+                UNIQUE(chat_id, from_chat_id, message_id, publish_date)
+            )''')
+            cursor.execute('''CREATE TABLE IF NOT EXISTS settings (
+                id BIGSERIAL PRIMARY KEY,
+                chat_id BIGINT UNIQUE,
+                time1 TEXT,
+                days_offset INTEGER DEFAULT 10,
+                timezone TEXT DEFAULT 'Asia/Bishkek',
+                send_mode TEXT DEFAULT 'forward',
+                spread_minutes INTEGER DEFAULT 0
+            )''')
+            cursor.execute('ALTER TABLE settings ADD COLUMN IF NOT EXISTS spread_minutes INTEGER DEFAULT 0')
+            cursor.execute('ALTER TABLE reposts ADD COLUMN IF NOT EXISTS dispatch_date TEXT')
+            cursor.execute('UPDATE reposts SET dispatch_date = publish_date WHERE dispatch_date IS NULL')
+            cursor.execute('''CREATE TABLE IF NOT EXISTS target_chats (
+                id BIGSERIAL PRIMARY KEY,
+                chat_id BIGINT UNIQUE,
+                target_chat_id BIGINT,
+                target_chat_username TEXT,
+                target_chat_title TEXT
+            )''')
+            cursor.execute('''CREATE TABLE IF NOT EXISTS delivery_log (
+                id BIGSERIAL PRIMARY KEY,
+                repost_id BIGINT,
+                chat_id BIGINT,
+                target_chat_id BIGINT,
+                scheduled_at TEXT,
+                sent_at TEXT,
+                attempts INTEGER,
+                method TEXT,
+                result_message_id BIGINT,
+                error_class TEXT
+            )''')
+            cursor.execute('CREATE INDEX IF NOT EXISTS idx_delivery_log_sent ON delivery_log (sent_at)')
+            cursor.execute('''CREATE TABLE IF NOT EXISTS breakers (
+                kind TEXT,
+                ref_id BIGINT,
+                message_id BIGINT,
+                failures INTEGER DEFAULT 0,
+                disabled INTEGER DEFAULT 0,
+                next_probe_at TEXT,
+                last_error TEXT,
+                PRIMARY KEY (kind, ref_id, message_id)
+            )''')
+            cursor.execute('''CREATE TABLE IF NOT EXISTS contents (
+                content_hash TEXT PRIMARY KEY,
+                content TEXT
+            )''')
+            cursor.execute('''CREATE TABLE IF NOT EXISTS message_contents (
+                from_chat_id BIGINT,
+                message_id BIGINT,
+                content_hash TEXT,
+                PRIMARY KEY (from_chat_id, message_id)
+            )''')
+            cursor.execute('''CREATE TABLE IF NOT EXISTS dispatch_cursor (
+                id INTEGER PRIMARY KEY CHECK (id = 1),
+                last_minute TEXT
+            )''')
+            cursor.execute('''CREATE TABLE IF NOT EXISTS chat_summary (
+                chat_id BIGINT PRIMARY KEY,
+                pending_count INTEGER DEFAULT 0,
+                published_count INTEGER DEFAULT 0,
+                next_due TEXT[] DEFAULT '{}',
+                last_delivery_at TEXT,
+                last_error TEXT
+            )''')
+            cursor.execute('CREATE INDEX IF NOT EXISTS idx_reposts_chat_pending ON reposts (chat_id, is_published, publish_date)')
+            cursor.execute('DROP INDEX IF EXISTS idx_reposts_due')
+            cursor.execute('CREATE INDEX IF NOT EXISTS idx_reposts_dispatch ON reposts (dispatch_date) WHERE is_published = 0')
+
+            # Сводка по чату поддерживается триггером, как и в SQLite
+            cursor.execute('''CREATE OR REPLACE FUNCTION chat_summary_refresh() RETURNS trigger AS $$
+            DECLARE
+                affected BIGINT;
+                pending_delta INTEGER := 0;
+                published_delta INTEGER := 0;
+            BEGIN
+                IF TG_OP <> 'DELETE' THEN
+                    affected := NEW.chat_id;
+                    IF NEW.is_published = 0 THEN pending_delta := pending_delta + 1;
+                    ELSE published_delta := published_delta + 1; END IF;
+                END IF;
+                IF TG_OP <> 'INSERT' THEN
+                    affected := OLD.chat_id;
+                    IF OLD.is_published = 0 THEN pending_delta := pending_delta - 1;
+                    ELSE published_delta := published_delta - 1; END IF;
+                END IF;
+                INSERT INTO chat_summary (chat_id) VALUES (affected) ON CONFLICT (chat_id) DO NOTHING;
+                UPDATE chat_summary SET
+                    pending_count = pending_count + pending_delta,
+                    published_count = published_count + published_delta,
+                    next_due = ARRAY(SELECT publish_date FROM reposts WHERE chat_id = affected AND is_published = 0
+                                     ORDER BY publish_date LIMIT 3)
+                WHERE chat_id = affected;
+                RETURN NULL;
+            END;
+            $$ LANGUAGE plpgsql''')
+            cursor.execute('DROP TRIGGER IF EXISTS chat_summary_insert_delete ON reposts')
+            cursor.execute('''CREATE TRIGGER chat_summary_insert_delete AFTER INSERT OR DELETE ON reposts
+                              FOR EACH ROW EXECUTE FUNCTION chat_summary_refresh()''')
+            cursor.execute('DROP TRIGGER IF EXISTS chat_summary_update ON reposts')
+            cursor.execute('''CREATE TRIGGER chat_summary_update AFTER UPDATE OF is_published, publish_date ON reposts
+                              FOR EACH ROW WHEN (OLD.is_published IS DISTINCT FROM NEW.is_published
+                                                 OR OLD.publish_date IS DISTINCT FROM NEW.publish_date)
+                              EXECUTE FUNCTION chat_summary_refresh()''')
+            logger.info("Таблицы PostgreSQL 'reposts', 'settings', 'target_chats' и 'chat_summary' созданы или уже существуют.")
+
+    def get_settings(self, chat_id):
+        with self.connect() as conn:
+            cursor = conn.cursor()
+            cursor.execute(f'SELECT {", ".join(SETTINGS_FIELDS)} FROM settings WHERE chat_id = %s', (chat_id,))
+            row = cursor.fetchone()
+        return dict(zip(SETTINGS_FIELDS, row)) if row else None
+
+    def replace_publish_times(self, chat_id, times_str):
+        with self.connect() as conn:
+            cursor = conn.cursor()
+            cursor.execute('DELETE FROM settings WHERE chat_id = %s', (chat_id,))
+            cursor.execute('INSERT INTO settings (chat_id, time1) VALUES (%s, %s)', (chat_id, times_str))
+
+    def update_settings(self, chat_id, **fields):
+        fields = {key: value for key, value in fields.items() if value is not None}
+        if not fields:
+            return
+        columns = list(fields)
+        values = [fields[column] for column in columns]
+        with self.connect() as conn:
+            cursor = conn.cursor()
+            cursor.execute(f'''INSERT INTO settings (chat_id, {", ".join(columns)})
+                               VALUES (%s{", %s" * len(columns)})
+                               ON CONFLICT (chat_id) DO UPDATE SET
+                               {", ".join(f"{column} = EXCLUDED.{column}" for column in columns)}''',
+                           [chat_id] + values)
+
+    def get_target(self, chat_id):
+        with self.connect() as conn:
+            cursor = conn.cursor()
+            cursor.execute('''SELECT target_chat_id, target_chat_username, target_chat_title
+                              FROM target_chats WHERE chat_id = %s''', (chat_id,))
+            row = cursor.fetchone()
+        return dict(zip(TARGET_FIELDS, row)) if row else None
+
+    def set_target(self, chat_id, target_chat_id, target_chat_username, target_chat_title=None):
+        with self.connect() as conn:
+            conn.cursor().execute('''INSERT INTO target_chats (chat_id, target_chat_id, target_chat_username, target_chat_title)
+                                     VALUES (%s, %s, %s, %s)
+                                     ON CONFLICT (chat_id) DO UPDATE SET target_chat_id = EXCLUDED.target_chat_id,
+                                         target_chat_username = EXCLUDED.target_chat_username,
+                                         target_chat_title = EXCLUDED.target_chat_title''',
+                                  (chat_id, target_chat_id, target_chat_username, target_chat_title))
+
+    def set_target_title(self, chat_id, target_chat_title):
+        with self.connect() as conn:
+            conn.cursor().execute('UPDATE target_chats SET target_chat_title = %s WHERE chat_id = %s',
+                                  (target_chat_title, chat_id))
+
+    def get_target_owners(self, target_chat_id):
+        with self.connect() as conn:
+            cursor = conn.cursor()
+            cursor.execute('SELECT chat_id FROM target_chats WHERE target_chat_id = %s ORDER BY chat_id', (target_chat_id,))
+            return [row[0] for row in cursor.fetchall()]
+
+    def add_reposts(self, rows):
+        rows = list(rows)
+        if not rows:
+            return 0
+        with self.connect() as conn:
+            cursor = conn.cursor()
+            psycopg2.extras.execute_values(cursor, '''
+                INSERT INTO reposts (chat_id, from_chat_id, message_id, publish_time, publish_date, is_published, dispatch_date)
+                VALUES %s ON CONFLICT DO NOTHING
+            ''', rows, page_size=len(rows))
+            return cursor.rowcount
+
+    def iter_reposts(self, chat_id, limit=None, published=None):
+        query = '''
+            SELECT id, from_chat_id, message_id, publish_time, publish_date, is_published, dispatch_date
+            FROM reposts
+            WHERE chat_id = %s
+        '''
+        params = [chat_id]
+        if published is not None:
+            query += ' AND is_published = %s'
+            params.append(1 if published else 0)
+        query += ' ORDER BY publish_date, id'
+        if limit is not None:
+            query += ' LIMIT %s'
+            params.append(limit)
+
+        # Именованный (серверный) курсор отдает строки порциями по FETCH_CHUNK_SIZE
+        with self.connect() as conn:
+            with conn.cursor(name='iter_reposts') as cursor:
+                cursor.itersize = FETCH_CHUNK_SIZE
+                cursor.execute(query, params)
+                yield from cursor
+
+    def delete_reposts(self, repost_ids):
+        repost_ids = list(repost_ids)
+        if not repost_ids:
+            return 0
+        with self.connect() as conn:
+            cursor = conn.cursor()
+            cursor.execute('DELETE FROM reposts WHERE id = ANY(%s)', (repost_ids,))
+            return cursor.rowcount
+
+    def clear_reposts(self, chat_id, published_only=False):
+        with self.connect() as conn:
+            cursor = conn.cursor()
+            if published_only:
+                cursor.execute('DELETE FROM reposts WHERE chat_id = %s AND is_published = 1', (chat_id,))
+            else:
+                cursor.execute('DELETE FROM reposts WHERE chat_id = %s', (chat_id,))
+            return cursor.rowcount
+
+    def claim_due(self, dispatch_date, after_id=0, limit=None):
+        with self.connect() as conn:
+            cursor = conn.cursor()
+            cursor.execute('''
+                WITH due AS (
+                    SELECT reposts.id FROM reposts
+                    LEFT JOIN target_chats ON reposts.chat_id = target_chats.chat_id
+                    WHERE reposts.is_published = 0 AND reposts.dispatch_date = %s AND reposts.id > %s
+                      AND (reposts.claimed_until IS NULL OR reposts.claimed_until < NOW())
+                      ''' + BREAKER_EXCLUSION.format(now='%s') + '''
+                    ORDER BY reposts.id
+                    LIMIT %s
+                    FOR UPDATE OF reposts SKIP LOCKED
+                )
+                UPDATE reposts SET claimed_until = NOW() + make_interval(secs => %s)
+                FROM due
+                WHERE reposts.id = due.id
+                RETURNING reposts.id, reposts.chat_id, reposts.from_chat_id, reposts.message_id,
+                          reposts.publish_time, reposts.publish_date,
+                          (SELECT target_chat_id FROM target_chats WHERE target_chats.chat_id = reposts.chat_id)
+            ''', (dispatch_date, after_id, dispatch_date, dispatch_date, limit, CLAIM_LEASE_SECONDS))
+            return sorted(cursor.fetchall())
+
+    def count_due_by_minute(self, start, end):
+        with self.connect() as conn:
+            cursor = conn.cursor()
+            cursor.execute('''SELECT dispatch_date, COUNT(*) FROM reposts
+                              WHERE is_published = 0 AND dispatch_date BETWEEN %s AND %s
+                              GROUP BY dispatch_date''', (start, end))
+            return dict(cursor.fetchall())
+
+    def mark_published(self, repost_id):
+        with self.connect() as conn:
+            conn.cursor().execute('UPDATE reposts SET is_published = 1, claimed_until = NULL WHERE id = %s', (repost_id,))
+
+    def get_active_chats(self):
+        with self.connect() as conn:
+            cursor = conn.cursor()
+            cursor.execute('SELECT DISTINCT chat_id FROM reposts')
+            return [row[0] for row in cursor.fetchall()]
+
+    def get_chat_summary(self, chat_id):
+        with self.connect() as conn:
+            cursor = conn.cursor()
+            cursor.execute(f'''
+                SELECT chat_summary.pending_count, chat_summary.published_count, chat_summary.next_due,
+                       chat_summary.last_delivery_at, chat_summary.last_error,
+                       {SUMMARY_SETTINGS_COLUMNS}, {SUMMARY_TARGET_COLUMNS}
+                FROM (SELECT %s::BIGINT AS chat_id) AS chat
+                LEFT JOIN settings ON settings.chat_id = chat.chat_id
+                LEFT JOIN target_chats ON target_chats.chat_id = chat.chat_id
+                LEFT JOIN chat_summary ON chat_summary.chat_id = chat.chat_id
+            ''', (chat_id,))
+            row = cursor.fetchone()
+        return _chat_summary_from_row(row[5:], row[0], row[1], list(row[2] or []), row[3], row[4])
+
+    def record_delivery_result(self, chat_id, delivered_at=None, error=None):
+        with self.connect() as conn:
+            cursor = conn.cursor()
+            if error is None:
+                cursor.execute('UPDATE chat_summary SET last_delivery_at = %s, last_error = NULL WHERE chat_id = %s',
+                               (delivered_at, chat_id))
+            else:
+                cursor.execute('UPDATE chat_summary SET last_error = %s WHERE chat_id = %s', (str(error), chat_id))
+
+    def add_delivery_log(self, entries):
+        entries = list(entries)
+        if not entries:
+            return
+        with self.connect() as conn:
+            psycopg2.extras.execute_values(conn.cursor(), f'''
+                INSERT INTO delivery_log ({', '.join(DELIVERY_LOG_FIELDS)}) VALUES %s
+            ''', entries, page_size=len(entries))
+
+    def iter_delivery_log(self, since):
+        with self.connect() as conn:
+            with conn.cursor(name='iter_delivery_log') as cursor:
+                cursor.itersize = FETCH_CHUNK_SIZE
+                cursor.execute(f'SELECT {", ".join(DELIVERY_LOG_FIELDS)} FROM delivery_log WHERE sent_at >= %s ORDER BY id',
+                               (since,))
+                yield from cursor
+
+    def record_breaker_failure(self, kind, ref_id, message_id, error, threshold, probe_at):
+        with self.connect() as conn:
+            cursor = conn.cursor()
+            cursor.execute('''
+                INSERT INTO breakers AS breaker (kind, ref_id, message_id, failures, disabled, next_probe_at, last_error)
+                VALUES (%s, %s, %s, 1, CASE WHEN %s <= 1 THEN 1 ELSE 0 END, %s, %s)
+                ON CONFLICT (kind, ref_id, message_id) DO UPDATE SET
+                    failures = breaker.failures + 1,
+                    disabled = CASE WHEN breaker.failures + 1 >= %s THEN 1 ELSE 0 END,
+                    next_probe_at = EXCLUDED.next_probe_at,
+                    last_error = EXCLUDED.last_error
+                RETURNING failures
+            ''', (kind, ref_id, message_id, threshold, probe_at, str(error), threshold))
+            return cursor.fetchone()[0] == threshold
+
+    def reset_breaker(self, kind, ref_id, message_id):
+        with self.connect() as conn:
+            conn.cursor().execute('DELETE FROM breakers WHERE kind = %s AND ref_id = %s AND message_id = %s',
+                                  (kind, ref_id, message_id))
+
+    def get_breakers(self):
+        with self.connect() as conn:
+            cursor = conn.cursor()
+            cursor.execute('SELECT kind, ref_id, message_id, disabled FROM breakers')
+            return {(kind, ref_id, message_id): disabled for kind, ref_id, message_id, disabled in cursor.fetchall()}
+
+    def get_dispatch_cursor(self):
+        with self.connect() as conn:
+            cursor = conn.cursor()
+            cursor.execute('SELECT last_minute FROM dispatch_cursor WHERE id = 1')
+            row = cursor.fetchone()
+            return row[0] if row else None
+
+    def set_dispatch_cursor(self, last_minute):
+        with self.connect() as conn:
+            conn.cursor().execute('''INSERT INTO dispatch_cursor (id, last_minute) VALUES (1, %s)
+                                     ON CONFLICT (id) DO UPDATE SET last_minute = EXCLUDED.last_minute''', (last_minute,))
+
+    def add_contents(self, entries):
+        entries = list(entries)
+        if not entries:
+            return
+        with self.connect() as conn:
+            cursor = conn.cursor()
+            psycopg2.extras.execute_values(cursor, '''
+                INSERT INTO contents (content_hash, content) VALUES %s ON CONFLICT (content_hash) DO NOTHING
+            ''', list({content_hash: (content_hash, content) for _, _, content_hash, content in entries}.values()))
+            psycopg2.extras.execute_values(cursor, '''
+                INSERT INTO message_contents (from_chat_id, message_id, content_hash) VALUES %s
+                ON CONFLICT (from_chat_id, message_id) DO UPDATE SET content_hash = EXCLUDED.content_hash
+            ''', list({entry[:2]: entry[:3] for entry in entries}.values()))
+
+    def get_content(self, from_chat_id, message_id):
+        with self.connect() as conn:
+            cursor = conn.cursor()
+            cursor.execute('''SELECT contents.content FROM message_contents
+                              JOIN contents ON contents.content_hash = message_contents.content_hash
+                              WHERE message_contents.from_chat_id = %s AND message_contents.message_id = %s''',
+                           (from_chat_id, message_id))
+            row = cursor.fetchone()
+            return row[0] if row else None
+
+    def iter_contents(self, chat_id):
+        with self.connect() as conn:
+            with conn.cursor(name='iter_contents') as cursor:
+                cursor.itersize = FETCH_CHUNK_SIZE
+                cursor.execute(ITER_CONTENTS_QUERY.format(param='%s'), (chat_id,))
+                yield from cursor
+
+
+# Создание хранилища по имени движка из config.py
+def create_storage(backend, sqlite_path='reposts.db', postgres_dsn=None, postgres_pool_size=10):
+    if backend == 'sqlite':
+        return SQLiteStorage(sqlite_path)
+    if backend == 'memory':
+        return MemoryStorage()
+    if backend == 'postgres':
+        return PostgresStorage(postgres_dsn, postgres_pool_size)
+    raise StorageError(f"Неизвестное хранилище: {backend}")